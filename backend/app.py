@@ -1,17 +1,27 @@
+import hmac
 import json
 import base64
 import asyncio
 import urllib.parse
+from functools import lru_cache
 
-from fastapi import APIRouter, HTTPException, Request, Query
+from fastapi import APIRouter, Depends, HTTPException, Request, Query
 from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, Response
 
+from backend.cache import SubscriptionCache, CachedSubscription, make_etag
+from backend.coalescing import SingleFlight
+from backend.template import Template
+from backend.ratelimit import rate_limit
 from services.vpn.manager import AsyncVPNManager
+from database.action_data_class import DataInteraction
 from config_data.config import Config, load_config
 
 config: Config = load_config()
 
+# Публичные эндпоинты, подписки (/sub, /subs, /web) - под лимитом запросов на подписчика (user_id + IP)
 router = APIRouter()
+# Служебные эндпоинты, доступны только на локальном адресе
+internal_router = APIRouter()
 
 CONNECT_HTML = """
 <!DOCTYPE html>
@@ -143,6 +153,15 @@ CONNECT_HTML = """
 """
 
 
+CONNECT_PAGE = Template(CONNECT_HTML)
+
+
+@lru_cache(maxsize=4096)
+def render_connect_page(app_url: str, vpn_name: str, server_address: str) -> bytes:
+    """Страница подключения, одинаковые рендеры берутся из кэша"""
+    return CONNECT_PAGE.render(app_url=app_url, vpn_name=vpn_name, server_address=server_address)
+
+
 @router.get("/")
 async def root():
     """
@@ -153,20 +172,66 @@ async def root():
         "version": "1.0.0",
         "endpoints": {
             "subscription": "GET /sub/{user_hash}/{user_id} - JSON для V2rayTUN",
+            "user_subscription": "GET /subs/{user_id}/{signature} - все ключи пользователя",
             "connect": "GET /connect?url=... - Редирект на приложение"
         }
     }
 
 
-@router.get("/sub/{user_hash}/{user_id}")
+async def resolve_vpn(request: Request, user_id: int, client_id: str) -> dict:
+    """
+    Информация о VPN для эндпоинтов подписки из базы (поиск по уникальному client_id).
+    Панель не опрашивается, поэтому ее сбои не ломают обновление подписок.
+    Одновременные запросы одного ключа делят один поиск
+    """
+    single_flight: SingleFlight = request.app.state.single_flight
+    return await single_flight.do(
+        ('vpn', user_id, client_id),
+        lambda: _load_vpn(request.app.state.session, user_id, client_id)
+    )
+
+
+async def _load_vpn(session: DataInteraction, user_id: int, client_id: str) -> dict:
+    vpn = await session.get_vpn_by_client_id(client_id)
+    if vpn is None or vpn.user_id != user_id or not vpn.active:
+        return {'found': False}
+    return {
+        'found': True,
+        'vpn_name': vpn.name,
+        'client_id': vpn.client_id,
+        'node': vpn.node,
+        'ws_path': vpn.ws_path,
+        'expires_at': vpn.expires_at
+    }
+
+
+@internal_router.get("/metrics")
+async def metrics(request: Request):
+    """Счетчики объединения запросов, кэша подписок и лимитера"""
+    cache: SubscriptionCache = request.app.state.sub_cache
+    limiter = request.app.state.rate_limiter
+    return {
+        "single_flight": request.app.state.single_flight.stats(),
+        "sub_cache": {"hits": cache.hits, "misses": cache.misses, "size": len(cache)},
+        "rate_limit": {"rejected": limiter.rejected, "buckets": len(limiter)}
+    }
+
+
+@router.get("/sub/{user_hash}/{user_id}", dependencies=[Depends(rate_limit)])
 async def get_subscription(
         user_hash: str,
         user_id: int,
         request: Request
 ):
     """
-    Эндпоинт для V2rayTUN - возвращает VLESS ссылку в теле ответа
+    Эндпоинт для V2rayTUN - возвращает VLESS ссылку в теле ответа.
+    Готовый ответ кэшируется, повторные запросы с If-None-Match получают 304
     """
+    cache: SubscriptionCache = request.app.state.sub_cache
+    entry = cache.get(user_hash, user_id)
+    if entry is not None:
+        return entry.response(request)
+
     try:
         manager: AsyncVPNManager = request.app.state.manager
         decoded_hash = base64.urlsafe_b64decode(user_hash + '==').decode()
@@ -176,57 +241,127 @@ async def get_subscription(
             raise HTTPException(status_code=404, detail="Invalid subscription")
 
         # Получаем информацию о VPN
-        vpn_info = await manager.get_vpn_info(int(user_id), client_id)
+        vpn_info = await resolve_vpn(request, int(user_id), client_id)
 
         if not vpn_info['found']:
             raise HTTPException(status_code=404, detail="VPN not found")
 
-        # Создаем VLESS конфиг
-        vless_config = {
-            "v": "2",
-            "ps": vpn_info['vpn_name'],  # Название в приложении
-            "add": config.site.domain,  # Домен сервера
-            "port": "443",  # Порт
-            "id": client_id,  # UUID клиента
-            "aid": "0",  # Alter ID
-            "scy": "auto",  # Шифрование
-            "net": "ws",  # Network type
-            "type": "none",  # Header type
-            "host": config.site.domain,  # Host header
-            "path": "/vpn",  # WebSocket path
-            "tls": "tls",  # TLS enabled
-            "sni": config.site.domain,  # SNI
-            "alpn": "h2,http/1.1",  # ALPN
-            "fp": "chrome"  # Fingerprint
+        # Клиент подключается к той ноде и тому шарду inbound, где он создан
+        vless_link = build_vless_link(
+            client_id, vpn_info['vpn_name'], vpn_info.get('node'), vpn_info.get('ws_path')
+        ).encode()
+
+        # Заголовки для V2rayTUN, трафик - из фонового сборщика (без обращения к панели),
+        # срок - из базы: в панели клиенты создаются бессрочными
+        traffic = dict(manager.get_traffic(client_id) or {})
+        traffic['expire'] = int(vpn_info['expires_at'].timestamp())
+        userinfo = format_userinfo(traffic)
+        app_headers = {
+            "profile-title": f"base64:{base64.b64encode(vpn_info['vpn_name'].encode()).decode()}",
+            "profile-update-interval": "24",
+            "update-always": "true",
+            "subscription-userinfo": userinfo
         }
 
-        # Конвертируем в Base64 для VLESS ссылки
-        config_json = json.dumps(vless_config, separators=(',', ':'))
-        config_base64 = base64.urlsafe_b64encode(config_json.encode()).decode()
+        entry = cache.put(user_hash, user_id, CachedSubscription(
+            client_ids=(client_id,),
+            body=vless_link,
+            etag=make_etag(vless_link, userinfo),
+            app_headers=app_headers
+        ))
+        return entry.response(request)
 
-        # Создаем VLESS ссылку
-        vless_link = f"vless://{config_base64}"
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
 
-        # Создаем response с VLESS ссылкой
-        response = Response(
-            content=vless_link,
-            media_type="text/plain; charset=utf-8"
-        )
 
-        # Добавляем заголовки для V2rayTUN
-        user_agent = request.headers.get("user-agent", "").lower()
-        if 'v2raytun' in user_agent or 'v2ray' in user_agent:
-            response.headers["profile-title"] = f"base64:{base64.b64encode(vpn_info['vpn_name'].encode()).decode()}"
-            response.headers["profile-update-interval"] = "24"
-            response.headers["update-always"] = "true"
+@router.get("/subs/{user_id}/{signature}", dependencies=[Depends(rate_limit)])
+async def get_user_subscription(
+        user_id: int,
+        signature: str,
+        request: Request
+):
+    """
+    Общая подписка пользователя: все активные ключи одним телом
+    (VLESS ссылки по строкам в base64). Ссылка подписана HMAC от user_id
+    """
+    manager: AsyncVPNManager = request.app.state.manager
+    # Сравниваем байты: compare_digest падает на не-ASCII строках
+    if not hmac.compare_digest(signature.encode(), manager.user_signature(user_id).encode()):
+        raise HTTPException(status_code=404, detail="Invalid subscription")
+
+    cache: SubscriptionCache = request.app.state.sub_cache
+    entry = cache.get(SubscriptionCache.USER_KEY, user_id)
+    if entry is not None:
+        return entry.response(request)
+
+    session: DataInteraction = request.app.state.session
+    vpns = await session.get_active_user_vpns(user_id)
+    if not vpns:
+        raise HTTPException(status_code=404, detail="VPN not found")
+
+    links = "\n".join(build_vless_link(vpn.client_id, vpn.name, vpn.node, vpn.ws_path) for vpn in vpns)
+    body = base64.b64encode(links.encode())
+
+    # Трафик суммируется по всем ключам, срок - ближайшее окончание подписки
+    traffic = {'upload': 0, 'download': 0, 'total': 0}
+    for vpn in vpns:
+        for field, value in (manager.get_traffic(vpn.client_id) or {}).items():
+            if field in traffic:
+                traffic[field] += value
+    traffic['expire'] = int(min(vpn.expires_at for vpn in vpns).timestamp())
+    userinfo = format_userinfo(traffic)
+
+    entry = cache.put(SubscriptionCache.USER_KEY, user_id, CachedSubscription(
+        client_ids=tuple(vpn.client_id for vpn in vpns),
+        body=body,
+        etag=make_etag(body, userinfo),
+        app_headers={
+            "profile-title": f"base64:{base64.b64encode(f'VPN ({len(vpns)})'.encode()).decode()}",
+            "profile-update-interval": "24",
+            "update-always": "true",
+            "subscription-userinfo": userinfo
+        }
+    ))
+    return entry.response(request)
 
-            # Добавляем информацию о трафике (бессрочно, безлимит)
-            response.headers["subscription-userinfo"] = "upload=0; download=0; total=0; expire=0"
 
-        return response
+def build_vless_link(client_id: str, vpn_name: str, node: str | None, ws_path: str | None = None) -> str:
+    """
+    VLESS ссылка ключа: нода, на которой он создан, и WebSocket путь его шарда inbound
+    (reverse proxy на 443 ведет путь шарда на порт inbound)
+    """
+    server = node or config.site.domain
+    vless_config = {
+        "v": "2",
+        "ps": vpn_name,  # Название в приложении
+        "add": server,  # Домен сервера
+        "port": "443",  # Порт
+        "id": client_id,  # UUID клиента
+        "aid": "0",  # Alter ID
+        "scy": "auto",  # Шифрование
+        "net": "ws",  # Network type
+        "type": "none",  # Header type
+        "host": server,  # Host header
+        "path": ws_path or "/vpn",  # WebSocket path шарда
+        "tls": "tls",  # TLS enabled
+        "sni": server,  # SNI
+        "alpn": "h2,http/1.1",  # ALPN
+        "fp": "chrome"  # Fingerprint
+    }
+
+    # Конвертируем в Base64 для VLESS ссылки
+    config_json = json.dumps(vless_config, separators=(',', ':'))
+    config_base64 = base64.urlsafe_b64encode(config_json.encode()).decode()
+    return f"vless://{config_base64}"
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
+
+def format_userinfo(traffic: dict) -> str:
+    """Значение заголовка subscription-userinfo (0 - безлимит/бессрочно)"""
+    return (f"upload={traffic.get('upload', 0)}; download={traffic.get('download', 0)}; "
+            f"total={traffic.get('total', 0)}; expire={traffic.get('expire', 0)}")
 
 
 def create_v2raytun_response(config_base64: str, vpn_info: dict, user_id: int) -> Response:
@@ -275,20 +410,21 @@ def create_v2raytun_response(config_base64: str, vpn_info: dict, user_id: int) -
 
 def generate_v2ray_config(client_id: str, vpn_info: dict, user_id: int) -> dict:
     """Генерирует конфиг в формате V2ray"""
+    server = vpn_info.get('node') or config.site.domain
     return {
         "v": "2",
         "ps": f"{vpn_info['vpn_name']}",
-        "add": config.site.domain,
+        "add": server,
         "port": "443",
         "id": client_id,
         "aid": "0",
         "scy": "auto",
         "net": "ws",
         "type": "none",
-        "host": config.site.domain,
-        "path": "/vpn",
+        "host": server,
+        "path": vpn_info.get('ws_path') or "/vpn",
         "tls": "tls",
-        "sni": config.site.domain,
+        "sni": server,
         "alpn": "h2,http/1.1",
         "fp": "chrome"
     }
@@ -360,18 +496,16 @@ async def connect_redirect(
                         decoded_hash = base64.urlsafe_b64decode(user_hash + '==').decode()
                         user_id_from_hash, client_id = decoded_hash.split(':')
 
-                        vpn_info = await manager.get_vpn_info(int(user_id_from_hash), client_id)
+                        vpn_info = await resolve_vpn(request, int(user_id_from_hash), client_id)
                         vpn_name = vpn_info['vpn_name'] if vpn_info['found'] else "Unknown VPN"
+                        server = vpn_info.get('node') or manager.domain
                     except:
                         vpn_name = "VPN Service"
+                        server = manager.domain
 
                     # Показываем страницу с авто-редиректом
                     deep_link = f"v2raytun://import-sub?uri={urllib.parse.quote(url)}"
-                    html_content = CONNECT_HTML.replace("{{ app_url }}", deep_link)
-                    html_content = html_content.replace("{{ vpn_name }}", vpn_name)
-                    html_content = html_content.replace("{{ server_address }}", manager.domain)
-
-                    return HTMLResponse(content=html_content)
+                    return HTMLResponse(content=render_connect_page(deep_link, vpn_name, server))
 
         # Если URL не распознан, делаем простой редирект
         return RedirectResponse(url=url)
@@ -380,7 +514,7 @@ async def connect_redirect(
         raise HTTPException(status_code=500, detail=f"Redirect error: {str(e)}")
 
 
-@router.get("/web/{user_hash}/{user_id}")
+@router.get("/web/{user_hash}/{user_id}", dependencies=[Depends(rate_limit)])
 async def web_subscription_page(
         user_hash: str,
         user_id: int,
@@ -397,7 +531,7 @@ async def web_subscription_page(
         if int(user_id_from_hash) != int(user_id):
             raise HTTPException(status_code=404, detail="Invalid subscription")
 
-        vpn_info = await manager.get_vpn_info(int(user_id), client_id)
+        vpn_info = await resolve_vpn(request, int(user_id), client_id)
 
         if not vpn_info['found']:
             raise HTTPException(status_code=404, detail="VPN not found")
@@ -408,9 +542,7 @@ async def web_subscription_page(
         connect_url = f"https://{manager.domain}/connect?url={urllib.parse.quote(deep_link)}"
 
         # Показываем страницу с авто-редиректом
-        html_content = CONNECT_HTML.replace("{{ app_url }}", deep_link)
-        html_content = html_content.replace("{{ vpn_name }}", vpn_info['vpn_name'])
-        html_content = html_content.replace("{{ server_address }}", manager.domain)
+        html_content = render_connect_page(deep_link, vpn_info['vpn_name'], vpn_info.get('node') or manager.domain)
 
         return HTMLResponse(content=html_content)
 
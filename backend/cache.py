@@ -0,0 +1,109 @@
+import hashlib
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import Response
+
+
+@dataclass
+class CachedSubscription:
+    """Готовый ответ подписки: тело, заголовки и ETag"""
+    # Клиенты, из которых собран ответ (для общей подписки пользователя - все его ключи)
+    client_ids: Tuple[str, ...]
+    body: bytes
+    etag: str
+    # Заголовки для всех клиентов и дополнительные - только для V2rayTUN
+    headers: Dict[str, str] = field(default_factory=dict)
+    app_headers: Dict[str, str] = field(default_factory=dict)
+    created: float = field(default_factory=time.monotonic)
+
+    def response(self, request: Request) -> Response:
+        """Ответ на запрос: 304, если у клиента уже эта версия, иначе тело из кэша"""
+        headers = {**self.headers, 'ETag': self.etag}
+        user_agent = request.headers.get('user-agent', '').lower()
+        if 'v2raytun' in user_agent or 'v2ray' in user_agent:
+            headers.update(self.app_headers)
+        if etag_matches(request.headers.get('if-none-match'), self.etag):
+            return Response(status_code=304, headers=headers)
+        return Response(content=self.body, headers=headers, media_type="text/plain; charset=utf-8")
+
+
+def make_etag(*parts: str | bytes) -> str:
+    """Сильный ETag по содержимому ответа"""
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else part.encode())
+    return f'"{digest.hexdigest()}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    return any(tag.strip().removeprefix('W/') == etag for tag in if_none_match.split(','))
+
+
+class SubscriptionCache:
+    """
+    Кэш готовых ответов подписки по (user_hash, user_id), общая подписка
+    пользователя хранится под (USER_KEY, user_id).
+    Запись сбрасывается при изменении клиента (переименование, удаление, вкл/выкл),
+    общая подписка - еще и при появлении у пользователя нового ключа,
+    а все записи - по истечении ttl, чтобы заголовок трафика не отставал от сборщика
+    """
+    USER_KEY = '*'
+
+    def __init__(self, ttl: float = 60, max_size: int = 100_000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Tuple[str, int], CachedSubscription] = OrderedDict()
+        self._keys_by_client: Dict[str, set] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, user_hash: str, user_id: int) -> Optional[CachedSubscription]:
+        key = (user_hash, user_id)
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry.created > self.ttl:
+            if entry is not None:
+                self._drop(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, user_hash: str, user_id: int, entry: CachedSubscription) -> CachedSubscription:
+        key = (user_hash, user_id)
+        self._drop(key)
+        self._entries[key] = entry
+        for client_id in entry.client_ids:
+            self._keys_by_client.setdefault(client_id, set()).add(key)
+        while len(self._entries) > self.max_size:
+            self._drop(next(iter(self._entries)))
+        return entry
+
+    def invalidate(self, client_id: str, user_id: Optional[int] = None):
+        """Сбрасывает все ответы по клиенту и, если известен user_id, общую подписку пользователя"""
+        for key in list(self._keys_by_client.get(client_id, ())):
+            self._drop(key)
+        if user_id is not None:
+            self._drop((self.USER_KEY, user_id))
+
+    def _drop(self, key: Tuple[str, int]):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for client_id in entry.client_ids:
+            keys = self._keys_by_client.get(client_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_client[client_id]
@@ -0,0 +1,42 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """
+    Объединение одновременных запросов: пока поиск по ключу выполняется,
+    остальные запросы с тем же ключом ждут его результат, а не запускают свой
+    """
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.calls = 0
+        self.executions = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        self.calls += 1
+        future = self._inflight.get(key)
+        if future is None:
+            self.executions += 1
+            future = asyncio.ensure_future(func())
+            self._inflight[key] = future
+            future.add_done_callback(lambda done: self._forget(key, done))
+        # shield - отмена одного ожидающего не должна отменять общий поиск
+        return await asyncio.shield(future)
+
+    def _forget(self, key: Hashable, future: asyncio.Future):
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+        # Ошибку получат ожидающие, а если их не осталось - не пишем "exception was never retrieved"
+        if not future.cancelled():
+            future.exception()
+
+    def stats(self) -> dict:
+        """Сколько запросов пришло, сколько поисков реально выполнено и доля объединенных"""
+        coalesced = self.calls - self.executions
+        return {
+            'calls': self.calls,
+            'executions': self.executions,
+            'coalesced': coalesced,
+            'coalescing_ratio': round(coalesced / self.calls, 4) if self.calls else 0.0,
+            'in_flight': len(self._inflight)
+        }
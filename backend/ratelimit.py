@@ -0,0 +1,57 @@
+import math
+import time
+from collections import OrderedDict
+from typing import Hashable, List
+
+from fastapi import HTTPException, Request
+
+
+class TokenBucketLimiter:
+    """
+    Token bucket на каждый ключ: до burst запросов подряд, дальше rate запросов в секунду.
+    Хранится не больше max_buckets корзин, давно не использованные вытесняются (LRU)
+    """
+    def __init__(self, burst: int = 10, rate: float = 0.2, max_buckets: int = 100_000):
+        self.burst = burst
+        self.rate = rate
+        self.max_buckets = max_buckets
+        self.rejected = 0
+        # ключ -> [токены, время последнего пополнения]
+        self._buckets: OrderedDict[Hashable, List[float]] = OrderedDict()
+
+    def acquire(self, key: Hashable) -> float:
+        """Забирает токен. Возвращает 0, если запрос разрешен, иначе сколько секунд ждать"""
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(self.burst), now]
+            if len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        self.rejected += 1
+        return (1 - bucket[0]) / self.rate
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+async def rate_limit(request: Request):
+    """Зависимость эндпоинтов подписки: ограничивает запросы по user_id из пути и IP клиента"""
+    limiter: TokenBucketLimiter | None = getattr(request.app.state, 'rate_limiter', None)
+    if limiter is None:
+        return
+    key = (request.path_params.get('user_id'), request.client.host if request.client else None)
+    retry_after = limiter.acquire(key)
+    if retry_after:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests",
+            headers={"Retry-After": str(math.ceil(retry_after))}
+        )
@@ -0,0 +1,41 @@
+import html
+import json
+import re
+from typing import Callable, List, Tuple
+
+SLOT_RE = re.compile(r"\{\{\s*(\w+)\s*\}\}")
+
+
+def escape_html(value: str) -> str:
+    return html.escape(value, quote=True)
+
+
+def escape_js(value: str) -> str:
+    """Значение для вставки внутрь строкового литерала JS в <script>"""
+    return json.dumps(value, ensure_ascii=False)[1:-1].replace('<', '\\u003c').replace('>', '\\u003e')
+
+
+class Template:
+    """
+    Шаблон, один раз разрезанный на статичные байтовые куски и слоты {{ name }}.
+    Рендер - склейка кусков с экранированными значениями: внутри <script>
+    значения экранируются как строка JS, в остальной разметке - как HTML
+    """
+    def __init__(self, source: str):
+        self.segments: List[bytes] = []
+        self.slots: List[Tuple[str, Callable[[str], str]]] = []
+        position = 0
+        for match in SLOT_RE.finditer(source):
+            before = source[:match.start()]
+            in_script = before.rfind('<script') > before.rfind('</script>')
+            self.segments.append(source[position:match.start()].encode())
+            self.slots.append((match.group(1), escape_js if in_script else escape_html))
+            position = match.end()
+        self.segments.append(source[position:].encode())
+
+    def render(self, **values: str) -> bytes:
+        parts = [self.segments[0]]
+        for (name, escape), segment in zip(self.slots, self.segments[1:]):
+            parts.append(escape(str(values[name])).encode())
+            parts.append(segment)
+        return b''.join(parts)
@@ -13,11 +13,18 @@ from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
-from backend.app import router
+from backend.app import router, internal_router
+from backend.cache import SubscriptionCache
+from backend.coalescing import SingleFlight
+from backend.ratelimit import TokenBucketLimiter
 from services.vpn.manager import AsyncVPNManager
+from database.action_data_class import DataInteraction
+from utils.reconcile import VpnReconciler
+from utils.schedulers import sweep_expired_vpns
 from storage.nats_storage import NatsStorage
 from utils.nats_connect import connect_to_nats
 from database.build import PostgresBuild
+from database.activity_buffer import ActivityBuffer
 from database.model import Base
 from config_data.config import load_config, Config
 from handlers.user_handlers import user_router
@@ -49,15 +56,30 @@ config: Config = load_config()
 
 async def main():
     database = PostgresBuild(config.db.dns)
-    await database.drop_tables(Base)
+    # Схема только дополняется до модели: новые таблицы, колонки и индексы, данные сохраняются
     await database.create_tables(Base)
+    await database.add_missing_columns(Base)
+    await database.create_indexes(Base)
     session = database.session()
+    activity = ActivityBuffer(session)
+    activity.start()
 
     scheduler: AsyncIOScheduler = AsyncIOScheduler()
     scheduler.start()
 
     manager = AsyncVPNManager()
     await manager.login()
+    try:
+        # Прогреваем кэш ID основного inbound, чтобы первый запрос не ходил за списком
+        await manager.get_or_create_main_inbound()
+    except Exception as err:
+        logger.warning(f'Не удалось получить основной inbound при старте: {err}')
+    await manager.refresh_clients()
+    # Периодически сверяем индекс клиентов с панелью
+    scheduler.add_job(manager.refresh_clients, 'interval', minutes=5, id='vpn_clients_refresh')
+    # Счетчики трафика для заголовков подписок и меню VPN, заодно проверка здоровья нод
+    manager.load_traffic()
+    scheduler.add_job(manager.collect_traffic, 'interval', minutes=1, id='vpn_traffic_collect')
 
     #nc, js = await connect_to_nats(servers=config.nats.servers)
     #storage: NatsStorage = await NatsStorage(nc=nc, js=js).create_storage()
@@ -65,16 +87,40 @@ async def main():
     bot = Bot(token=config.bot.token, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
     dp = Dispatcher()  # storage=storage)
 
+    # Ночная пакетная чистка истекших VPN
+    scheduler.add_job(sweep_expired_vpns, 'cron', hour=3, args=[bot, DataInteraction(session), manager],
+                      id='expired_vpns_sweep')
+    # Сверка базы с панелями: удаление сирот и восстановление пропавших клиентов
+    reconciler = VpnReconciler(manager, DataInteraction(session))
+    scheduler.add_job(reconciler.run, 'interval', minutes=30, id='vpn_reconcile')
+
     # подключаем роутеры
     dp.include_routers(user_router, *get_dialogs())
 
     # подключаем middleware
-    dp.update.middleware(TransferObjectsMiddleware())
+    dp.update.middleware(TransferObjectsMiddleware(unit_of_work=config.db.unit_of_work))
     dp.update.middleware(RemindMiddleware())
 
     app = FastAPI()
     app.include_router(router)
     app.state.manager = manager
+    app.state.session = DataInteraction(session)
+    # Одновременные запросы подписки одного ключа делят один поиск
+    app.state.single_flight = SingleFlight()
+    # Лимит запросов на подписчика, чтобы частый опрос не нагружал бота и панель
+    app.state.rate_limiter = TokenBucketLimiter(
+        burst=config.backend.rate_limit_burst,
+        rate=config.backend.rate_limit_rate,
+        max_buckets=config.backend.rate_limit_buckets
+    )
+    # Кэш готовых ответов /sub, сбрасывается при изменении клиента
+    app.state.sub_cache = SubscriptionCache()
+    manager.add_change_listener(app.state.sub_cache.invalidate)
+
+    # Служебное приложение (/metrics) с тем же состоянием, слушает только localhost
+    internal_app = FastAPI()
+    internal_app.include_router(internal_router)
+    internal_app.state = app.state
 
     # запуск
     await bot.delete_webhook(drop_pending_updates=True)
@@ -83,8 +129,13 @@ async def main():
 
     uvicorn_config = uvicorn.Config(app, host='0.0.0.0', port=8000, log_level="info")  # ssl_keyfile='ssl/key.pem', ssl_certfile='ssl/cert.pem'
     server = uvicorn.Server(uvicorn_config)
+    internal_server = uvicorn.Server(uvicorn.Config(
+        internal_app, host='127.0.0.1', port=config.backend.metrics_port, log_level="warning"
+    ))
 
-    aiogram_task = asyncio.create_task(dp.start_polling(bot, _session=session, _scheduler=scheduler, vpn_manager=manager))
+    # Служебный сервер стартует первым, чтобы обработчики сигналов остались за основным
+    internal_task = asyncio.create_task(internal_server.serve())
+    aiogram_task = asyncio.create_task(dp.start_polling(bot, _session=session, _scheduler=scheduler, _activity=activity, vpn_manager=manager))
     uvicorn_task = asyncio.create_task(server.serve())
 
     try:
@@ -92,7 +143,12 @@ async def main():
     except Exception as e:
         logger.exception(e)
     finally:
+        internal_server.should_exit = True
+        await internal_task
         #await nc.close()
+        # Дописываем накопленную активность пользователей
+        await activity.stop()
+        await manager.close()
         logger.info('Connection closed')
 
 
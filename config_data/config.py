@@ -16,6 +16,7 @@ class tg_bot:
 @dataclass
 class DB:
     dns: str
+    unit_of_work: bool
 
 
 @dataclass
@@ -28,6 +29,29 @@ class Site:
     domain: str
     username: str
     password: str
+    inbound_port: int
+    inbound_shards: int
+    inbound_client_cap: int
+    traffic_cache_path: str | None
+    panel_max_inflight: int
+    panel_failure_threshold: int
+    panel_reset_timeout: float
+
+
+@dataclass
+class VpnNode:
+    domain: str
+    username: str
+    password: str
+
+
+@dataclass
+class Backend:
+    rate_limit_burst: int
+    rate_limit_rate: float
+    rate_limit_buckets: int
+    subscription_secret: str | None
+    metrics_port: int
 
 
 @dataclass
@@ -49,19 +73,27 @@ class Config:
     yookassa: Yookassa
     oxapay: OxaPay
     site: Site
+    nodes: list[VpnNode]
+    backend: Backend
 
 
 def load_config(path: str | None = None) -> Config:
     env: Env = Env()
     env.read_env(path)
 
+    # Ноды задаются списком domain:username:password, по умолчанию - одна панель на домене сайта
+    nodes = [VpnNode(*node.split(':', 2)) for node in env.list('vpn_nodes', [])]
+    if not nodes:
+        nodes = [VpnNode(domain=env('domain'), username=env('username'), password=env('password'))]
+
     return Config(
         bot=tg_bot(
             token=env('token'),
             admin_ids=list(map(int, env.list('admins')))
             ),
         db=DB(
-            dns=env('dns')
+            dns=env('dns'),
+            unit_of_work=env.bool('db_unit_of_work', False)
         ),
         nats=NatsConfig(
             servers=env.list('nats')
@@ -76,6 +108,22 @@ def load_config(path: str | None = None) -> Config:
         site=Site(
             domain=env('domain'),
             username=env('username'),
-            password=env('password')
+            password=env('password'),
+            inbound_port=env.int('inbound_port', 62789),
+            inbound_shards=env.int('inbound_shards', 1),
+            # 0 - без лимита клиентов на шард
+            inbound_client_cap=env.int('inbound_client_cap', 0),
+            traffic_cache_path=env('traffic_cache_path', None),
+            panel_max_inflight=env.int('panel_max_inflight', 50),
+            panel_failure_threshold=env.int('panel_failure_threshold', 5),
+            panel_reset_timeout=env.float('panel_reset_timeout', 30.0)
+        ),
+        nodes=nodes,
+        backend=Backend(
+            rate_limit_burst=env.int('rate_limit_burst', 10),
+            rate_limit_rate=env.float('rate_limit_rate', 0.2),
+            rate_limit_buckets=env.int('rate_limit_buckets', 100000),
+            subscription_secret=env('subscription_secret', None),
+            metrics_port=env.int('metrics_port', 8001)
         )
     )
@@ -1,7 +1,8 @@
 import datetime
 
 from dateutil.relativedelta import relativedelta
-from sqlalchemy import select, insert, update, column, text, delete
+from sqlalchemy import select, insert, update, column, text, delete, func, literal, exists
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
 from database.model import (UsersTable, DeeplinksTable, OneTimeLinksIdsTable, AdminsTable, UserVpnTable)
@@ -17,15 +18,14 @@ class DataInteraction():
         return True if result else False
 
     async def add_user(self, user_id: int, username: str, name: str, referral: int | None = None):
-        if await self.check_user(user_id):
-            return
+        # Существующий пользователь не трогается, без предварительной проверки check_user
         async with self._sessions() as session:
-            await session.execute(insert(UsersTable).values(
+            await session.execute(pg_insert(UsersTable).values(
                 user_id=user_id,
                 username=username,
                 name=name,
                 referral=referral,
-            ))
+            ).on_conflict_do_nothing(index_elements=[UsersTable.user_id]))
             await session.commit()
 
     async def add_refs(self, user_id: int):
@@ -35,13 +35,17 @@ class DataInteraction():
             ))
             await session.commit()
 
-    async def add_vpn(self, user_id: int, client_id: str, name: str, link: str, expires_at: datetime.datetime):
+    async def add_vpn(self, user_id: int, client_id: str, name: str, link: str, expires_at: datetime.datetime,
+                      inbound_id: int | None = None, node: str | None = None, ws_path: str | None = None):
         async with self._sessions() as session:
             await session.execute(insert(UserVpnTable).values(
                 user_id=user_id,
                 client_id=client_id,
                 name=name,
                 link=link,
+                inbound_id=inbound_id,
+                node=node,
+                ws_path=ws_path,
                 expires_at=expires_at
             ))
             await session.commit()
@@ -69,9 +73,11 @@ class DataInteraction():
 
     async def add_admin(self, user_id: int, name: str):
         async with self._sessions() as session:
-            await session.execute(insert(AdminsTable).values(
-                user_id=user_id,
-                name=name
+            # INSERT ... SELECT WHERE NOT EXISTS не требует уникального индекса admins.user_id:
+            # в старых базах с дублями админов он может не создаться
+            await session.execute(insert(AdminsTable).from_select(
+                ['user_id', 'name'],
+                select(literal(user_id), literal(name)).where(~exists().where(AdminsTable.user_id == user_id))
             ))
             await session.commit()
 
@@ -80,6 +86,24 @@ class DataInteraction():
             result = await session.scalars(select(UsersTable))
         return result.fetchall()
 
+    async def get_stats(self) -> dict:
+        # Вся статистика одним агрегирующим запросом, строки пользователей в память не загружаются
+        now = datetime.datetime.now()
+        today = datetime.datetime.combine(now.date(), datetime.time())
+        yesterday = today - datetime.timedelta(days=1)
+        day_before = today - datetime.timedelta(days=2)
+        async with self._sessions() as session:
+            result = await session.execute(select(
+                func.count().label('total'),
+                func.count().filter(UsersTable.active != 0).label('active'),
+                func.count().filter(UsersTable.activity > now - datetime.timedelta(days=1)).label('activity'),
+                func.count().filter(UsersTable.entry >= today).label('today'),
+                func.count().filter(UsersTable.entry >= yesterday, UsersTable.entry < today).label('yesterday'),
+                func.count().filter(UsersTable.entry >= day_before, UsersTable.entry < yesterday).label('day_before')
+            ).select_from(UsersTable))
+            stats = result.one()
+        return dict(stats._mapping)
+
     async def get_user(self, user_id: int):
         async with self._sessions() as session:
             result = await session.scalar(select(UsersTable).where(UsersTable.user_id == user_id))
@@ -95,6 +119,15 @@ class DataInteraction():
             result = await session.scalars(select(UserVpnTable).where(UserVpnTable.user_id == user_id))
         return result.fetchall()
 
+    async def get_active_user_vpns(self, user_id: int):
+        async with self._sessions() as session:
+            result = await session.scalars(select(UserVpnTable).where(
+                UserVpnTable.user_id == user_id,
+                UserVpnTable.active.is_(True),
+                UserVpnTable.expires_at > datetime.datetime.now()
+            ).order_by(UserVpnTable.id))
+        return result.fetchall()
+
     async def get_vpn_by_id(self, id: int):
         async with self._sessions() as session:
             result = await session.scalar(select(UserVpnTable).where(UserVpnTable.id == id))
@@ -105,6 +138,29 @@ class DataInteraction():
             result = await session.scalar(select(UserVpnTable).where(UserVpnTable.client_id == client_id))
         return result
 
+    async def get_expired_vpns(self):
+        async with self._sessions() as session:
+            result = await session.scalars(select(UserVpnTable).where(
+                UserVpnTable.active.is_(True),
+                UserVpnTable.expires_at <= datetime.datetime.now()
+            ))
+        return result.fetchall()
+
+    async def iter_vpns(self, batch_size: int = 1000):
+        # Keyset-пагинация по id: каждая страница - короткий запрос без OFFSET
+        last_id = 0
+        while True:
+            async with self._sessions() as session:
+                result = await session.scalars(select(UserVpnTable).where(
+                    UserVpnTable.id > last_id
+                ).order_by(UserVpnTable.id).limit(batch_size))
+                vpns = result.fetchall()
+            if not vpns:
+                return
+            for vpn in vpns:
+                yield vpn
+            last_id = vpns[-1].id
+
     async def get_links(self):
         async with self._sessions() as session:
             result = await session.scalars(select(OneTimeLinksIdsTable))
@@ -134,6 +190,15 @@ class DataInteraction():
             ))
             await session.commit()
 
+    async def update_vpn_node(self, vpn_id: int, node: str, inbound_id: int, ws_path: str | None = None):
+        async with self._sessions() as session:
+            await session.execute(update(UserVpnTable).where(UserVpnTable.id == vpn_id).values(
+                node=node,
+                inbound_id=inbound_id,
+                ws_path=ws_path
+            ))
+            await session.commit()
+
     async def update_user_earn(self, user_id: int, earn: int):
         async with self._sessions() as session:
             await session.execute(update(UsersTable).where(UsersTable.user_id == user_id).values(
@@ -160,15 +225,22 @@ class DataInteraction():
             await session.execute(delete(UserVpnTable).where(UserVpnTable.id == vpn_id))
             await session.commit()
 
+    async def del_user_vpns(self, vpn_ids: list[int]):
+        async with self._sessions() as session:
+            await session.execute(delete(UserVpnTable).where(UserVpnTable.id.in_(vpn_ids)))
+            await session.commit()
+
     async def del_deeplink(self, link: str):
         async with self._sessions() as session:
             await session.execute(delete(DeeplinksTable).where(DeeplinksTable.link == link))
             await session.commit()
 
-    async def del_link(self, link_id: str):
+    async def del_link(self, link_id: str) -> bool:
+        # True, если ссылка была и удалена именно этим вызовом (одноразовость без гонок)
         async with self._sessions() as session:
-            await session.execute(delete(OneTimeLinksIdsTable).where(OneTimeLinksIdsTable.link == link_id))
+            result = await session.execute(delete(OneTimeLinksIdsTable).where(OneTimeLinksIdsTable.link == link_id))
             await session.commit()
+        return result.rowcount > 0
 
     async def del_admin(self, user_id: int):
         async with self._sessions() as session:
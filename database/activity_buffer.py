@@ -0,0 +1,74 @@
+import asyncio
+import datetime
+import logging
+from typing import Dict, Optional
+
+from sqlalchemy import update, values, column, BigInteger, DateTime
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from database.model import UsersTable
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityBuffer:
+    """
+    Отложенная запись активности пользователей.
+    Хранит последнее время активности каждого пользователя и сбрасывает их в базу
+    пачкой - раз в flush_interval секунд или при накоплении max_size пользователей,
+    одним UPDATE ... FROM (VALUES ...) на пачку
+    """
+    # Две переменные на строку, держимся далеко от лимита параметров asyncpg (32767)
+    chunk_size = 5000
+
+    def __init__(self, sessions: async_sessionmaker, flush_interval: float = 5, max_size: int = 1000):
+        self._sessions = sessions
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self._pending: Dict[int, datetime.datetime] = {}
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._size_flush: Optional[asyncio.Task] = None
+
+    def record(self, user_id: int):
+        self._pending[user_id] = datetime.datetime.today()
+        if len(self._pending) >= self.max_size and (self._size_flush is None or self._size_flush.done()):
+            self._size_flush = asyncio.create_task(self.flush())
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Останавливает таймер и записывает остаток буфера"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            rows = list(batch.items())
+            try:
+                async with self._sessions() as session:
+                    for start in range(0, len(rows), self.chunk_size):
+                        activity = values(
+                            column('user_id', BigInteger), column('activity', DateTime), name='activity'
+                        ).data(rows[start:start + self.chunk_size])
+                        await session.execute(update(UsersTable).where(
+                            UsersTable.user_id == activity.c.user_id
+                        ).values(activity=activity.c.activity))
+                    await session.commit()
+            except Exception as e:
+                logger.error(f'Не удалось записать активность {len(rows)} пользователей: {e}')
+                # Возвращаем в буфер то, что не перезаписано более свежей активностью
+                for user_id, timestamp in rows:
+                    self._pending.setdefault(user_id, timestamp)
@@ -1,6 +1,11 @@
+import logging
+
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from database.model import Base
 
+logger = logging.getLogger(__name__)
+
 
 class PostgresBuild:
     def __init__(self, url: str):
@@ -10,6 +15,29 @@ class PostgresBuild:
         async with self.engine.begin() as conn:
             await conn.run_sync(base.metadata.create_all)
 
+    async def add_missing_columns(self, base):
+        # Досоздает в существующих таблицах новые колонки модели (только nullable - они не требуют значений)
+        async with self.engine.begin() as conn:
+            for table in base.metadata.sorted_tables:
+                for column in table.columns:
+                    if column.primary_key or not column.nullable:
+                        continue
+                    column_type = column.type.compile(dialect=conn.dialect)
+                    await conn.execute(text(
+                        f'ALTER TABLE "{table.name}" ADD COLUMN IF NOT EXISTS "{column.name}" {column_type}'
+                    ))
+
+    async def create_indexes(self, base):
+        # Досоздает индексы модели в уже существующей базе, данные не трогаются
+        for table in base.metadata.sorted_tables:
+            for index in table.indexes:
+                try:
+                    async with self.engine.begin() as conn:
+                        await conn.run_sync(lambda sync_conn: index.create(sync_conn, checkfirst=True))
+                except Exception as e:
+                    # Например, уникальный индекс при дублях в старых данных
+                    logger.warning(f'Не удалось создать индекс {index.name}: {e}')
+
     async def drop_tables(self, base):
         async with self.engine.begin() as conn:
             await conn.run_sync(base.metadata.drop_all)
@@ -0,0 +1,109 @@
+"""
+Проверка планов горячих запросов DataInteraction.
+
+    python -m database.explain_check --rows 1000000
+
+Во временной схеме создаются таблицы модели с индексами, заполняются rows
+строками, и для каждого горячего запроса снимается EXPLAIN. Если хоть один
+запрос планируется через Seq Scan - скрипт завершается с кодом 1.
+Схема удаляется после проверки, рабочие таблицы не затрагиваются
+"""
+import argparse
+import asyncio
+import datetime
+import sys
+
+from sqlalchemy import select, func, text
+from sqlalchemy.dialects import postgresql
+
+from database.build import PostgresBuild
+from database.model import Base, UsersTable, UserVpnTable, DeeplinksTable, OneTimeLinksIdsTable, AdminsTable
+from config_data.config import Config, load_config
+
+SCHEMA = 'explain_check'
+
+
+def hot_queries(rows: int) -> dict:
+    """Запросы DataInteraction, которые выполняются на каждое действие пользователя"""
+    now = datetime.datetime.now()
+    user_id = rows // 2
+    return {
+        'check_user': select(UsersTable).where(UsersTable.user_id == user_id),
+        'get_user_vpns': select(UserVpnTable).where(UserVpnTable.user_id == user_id),
+        'get_vpn_by_client_id': select(UserVpnTable).where(UserVpnTable.client_id == 'missing-client'),
+        'get_expired_vpns': select(UserVpnTable).where(
+            UserVpnTable.active.is_(True),
+            UserVpnTable.expires_at <= now
+        ),
+        'add_entry': select(DeeplinksTable).where(DeeplinksTable.link == 'missing-link'),
+        'del_link': select(OneTimeLinksIdsTable).where(OneTimeLinksIdsTable.link == 'missing-link'),
+        'get_admin': select(AdminsTable).where(AdminsTable.user_id == user_id),
+        'activity_24h': select(func.count()).select_from(UsersTable).where(
+            UsersTable.activity >= now - datetime.timedelta(days=1)
+        ),
+        'entry_24h': select(func.count()).select_from(UsersTable).where(
+            UsersTable.entry >= now - datetime.timedelta(days=1)
+        ),
+    }
+
+
+FILL_SQL = [
+    """INSERT INTO users (username, name, user_id, refs, earn, active, activity, entry)
+       SELECT 'user' || g, 'name' || g, g, 0, 0, 1,
+              now() - (g % 1000) * interval '1 day' - interval '1 hour',
+              now() - (g % 1000) * interval '1 day' - interval '1 hour'
+       FROM generate_series(1, :rows) g""",
+    """INSERT INTO "user-vpn" (user_id, client_id, name, link, active, expires_at, "create")
+       SELECT g, md5(g::text), 'VPN', 'link', true, now() + (g % 365 + 1) * interval '1 day', now()
+       FROM generate_series(1, :rows) g""",
+    """INSERT INTO deeplinks (link, entry) SELECT md5(g::text), 0 FROM generate_series(1, :rows) g""",
+    """INSERT INTO links (link) SELECT md5(g::text) FROM generate_series(1, :rows) g""",
+    """INSERT INTO admins (user_id, name) SELECT g, 'admin' FROM generate_series(1, :rows) g""",
+]
+
+
+async def check(dsn: str, rows: int) -> bool:
+    database = PostgresBuild(dsn)
+    ok = True
+    try:
+        async with database.engine.begin() as conn:
+            await conn.execute(text(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE'))
+            await conn.execute(text(f'CREATE SCHEMA {SCHEMA}'))
+            await conn.execute(text(f'SET LOCAL search_path TO {SCHEMA}'))
+            scoped = await conn.execution_options(schema_translate_map={None: SCHEMA})
+            await scoped.run_sync(Base.metadata.create_all)
+
+            for statement in FILL_SQL:
+                await conn.execute(text(statement), {'rows': rows})
+            await conn.execute(text('ANALYZE'))
+
+            for name, query in hot_queries(rows).items():
+                compiled = query.compile(dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True})
+                plan = [line for (line,) in await conn.execute(text(f'EXPLAIN {compiled}'))]
+                seq_scan = any('Seq Scan' in line for line in plan)
+                ok = ok and not seq_scan
+                print(f"{'FAIL' if seq_scan else 'ok  '} {name}: {plan[0].strip()}")
+                if seq_scan:
+                    print('\n'.join(f'       {line}' for line in plan))
+
+            await conn.execute(text(f'DROP SCHEMA {SCHEMA} CASCADE'))
+    finally:
+        await database.engine.dispose()
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EXPLAIN-проверка горячих запросов")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="строк в каждой таблице")
+    parser.add_argument("--dsn", default=None, help="строка подключения (по умолчанию из конфига)")
+    args = parser.parse_args()
+
+    dsn = args.dsn
+    if dsn is None:
+        config: Config = load_config()
+        dsn = config.db.dns
+    sys.exit(0 if asyncio.run(check(dsn, args.rows)) else 1)
+
+
+if __name__ == "__main__":
+    main()
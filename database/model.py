@@ -22,8 +22,8 @@ class UsersTable(Base):
     refs: Mapped[int] = mapped_column(Integer, default=0)
     earn: Mapped[int] = mapped_column(Integer, default=0)
     active: Mapped[int] = mapped_column(Integer, default=1)
-    activity: Mapped[datetime.datetime] = mapped_column(DateTime(timezone=False), default=func.now())
-    entry: Mapped[datetime.datetime] = mapped_column(DateTime(timezone=False), default=func.now())
+    activity: Mapped[datetime.datetime] = mapped_column(DateTime(timezone=False), default=func.now(), index=True)
+    entry: Mapped[datetime.datetime] = mapped_column(DateTime(timezone=False), default=func.now(), index=True)
     vpns: Mapped[List["UserVpnTable"]] = relationship("UserVpnTable", lazy="selectin", cascade='delete', uselist=True)
 
 
@@ -32,12 +32,16 @@ class UserVpnTable(Base):
 
     id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
 
-    user_id: Mapped[int] = mapped_column(ForeignKey('users.user_id', ondelete='cascade'))
+    user_id: Mapped[int] = mapped_column(ForeignKey('users.user_id', ondelete='cascade'), index=True)
     client_id: Mapped[str] = mapped_column(VARCHAR, unique=True)
     name: Mapped[str] = mapped_column(VARCHAR)
     link: Mapped[str] = mapped_column(VARCHAR)
+    inbound_id: Mapped[int] = mapped_column(Integer, nullable=True)
+    node: Mapped[str] = mapped_column(VARCHAR, nullable=True)
+    # WebSocket путь шарда inbound, NULL - основной /vpn
+    ws_path: Mapped[str] = mapped_column(VARCHAR, nullable=True)
     active: Mapped[bool] = mapped_column(Boolean, default=True)
-    expires_at: Mapped[datetime.datetime] = mapped_column(DateTime(timezone=False))
+    expires_at: Mapped[datetime.datetime] = mapped_column(DateTime(timezone=False), index=True)
     create: Mapped[datetime.datetime] = mapped_column(DateTime(timezone=False), default=func.now())
 
 
@@ -46,7 +50,7 @@ class DeeplinksTable(Base):
 
     id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
 
-    link: Mapped[str] = mapped_column(VARCHAR)
+    link: Mapped[str] = mapped_column(VARCHAR, unique=True, index=True)
     entry: Mapped[int] = mapped_column(BigInteger, default=0)
 
 
@@ -55,7 +59,7 @@ class AdminsTable(Base):
 
     id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
 
-    user_id: Mapped[int] = mapped_column(BigInteger)
+    user_id: Mapped[int] = mapped_column(BigInteger, unique=True, index=True)
     name: Mapped[str] = mapped_column(VARCHAR)
 
 
@@ -64,5 +68,5 @@ class OneTimeLinksIdsTable(Base):
 
     id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
 
-    link: Mapped[str] = mapped_column(VARCHAR)
+    link: Mapped[str] = mapped_column(VARCHAR, unique=True, index=True)
 
@@ -0,0 +1,63 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+
+class _SharedSession:
+    """
+    Общая сессия апдейта для методов DataInteraction.
+    commit внутри метода превращается в flush: изменения видны следующим запросам
+    обработчика, а фиксируются одной транзакцией в конце апдейта
+    """
+    def __init__(self, session: AsyncSession):
+        self._session = session
+
+    async def commit(self):
+        await self._session.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+
+class UnitOfWork:
+    """
+    Одна сессия и транзакция на апдейт. Подставляется в DataInteraction вместо
+    async_sessionmaker: сессия берется из пула только при первом запросе,
+    commit/rollback делает finish() в конце обработчика.
+    Фоновые задачи, запущенные из обработчика, и вызовы после finish()
+    получают обычные отдельные сессии
+    """
+    def __init__(self, sessions: async_sessionmaker):
+        self._sessions = sessions
+        self._session: Optional[AsyncSession] = None
+        self._owner = asyncio.current_task()
+        self._closed = False
+        # AsyncSession нельзя использовать из нескольких корутин одновременно
+        self._lock = asyncio.Lock()
+
+    def __call__(self):
+        if self._closed or asyncio.current_task() is not self._owner:
+            return self._sessions()
+        return self._shared()
+
+    @asynccontextmanager
+    async def _shared(self):
+        async with self._lock:
+            if self._session is None:
+                self._session = self._sessions()
+            yield _SharedSession(self._session)
+
+    async def finish(self, failed: bool = False):
+        self._closed = True
+        if self._session is None:
+            return
+        try:
+            if failed:
+                await self._session.rollback()
+            else:
+                await self._session.commit()
+        finally:
+            await self._session.close()
+            self._session = None
@@ -18,34 +18,13 @@ from states.state_groups import startSG, adminSG
 
 async def get_static(clb: CallbackQuery, widget: Button, dialog_manager: DialogManager):
     session: DataInteraction = dialog_manager.middleware_data.get('session')
-    users = await session.get_users()
-    active = 0
-    entry = {
-        'today': 0,
-        'yesterday': 0,
-        '2_day_ago': 0
-    }
-    activity = 0
-    for user in users:
-        if user.active:
-            active += 1
-        for day in range(0, 3):
-            #print(user.entry.date(), (datetime.datetime.today() - datetime.timedelta(days=day)).date())
-            if user.entry.date() == (datetime.datetime.today() - datetime.timedelta(days=day)).date():
-                if day == 0:
-                    entry['today'] = entry.get('today') + 1
-                elif day == 1:
-                    entry['yesterday'] = entry.get('yesterday') + 1
-                else:
-                    entry['2_day_ago'] = entry.get('2_day_ago') + 1
-        if user.activity.timestamp() > (datetime.datetime.today() - datetime.timedelta(days=1)).timestamp():
-            activity += 1
-
-    text = (f'<b>Статистика на {datetime.datetime.today().strftime("%d-%m-%Y")}</b>\n\nВсего пользователей: {len(users)}'
-            f'\n - Активные пользователи(не заблокировали бота): {active}\n - Пользователей заблокировали '
-            f'бота: {len(users) - active}\n - Провзаимодействовали с ботом за последние 24 часа: {activity}\n\n'
-            f'<b>Прирост аудитории:</b>\n - За сегодня: +{entry.get("today")}\n - Вчера: +{entry.get("yesterday")}'
-            f'\n - Позавчера: + {entry.get("2_day_ago")}')
+    stats = await session.get_stats()
+
+    text = (f'<b>Статистика на {datetime.datetime.today().strftime("%d-%m-%Y")}</b>\n\nВсего пользователей: {stats["total"]}'
+            f'\n - Активные пользователи(не заблокировали бота): {stats["active"]}\n - Пользователей заблокировали '
+            f'бота: {stats["total"] - stats["active"]}\n - Провзаимодействовали с ботом за последние 24 часа: {stats["activity"]}\n\n'
+            f'<b>Прирост аудитории:</b>\n - За сегодня: +{stats["today"]}\n - Вчера: +{stats["yesterday"]}'
+            f'\n - Позавчера: + {stats["day_before"]}')
     await clb.message.answer(text=text)
 
 
@@ -51,6 +51,7 @@ user_dialog = Dialog(
     Window(
         Const('<b>🌐Список ваших VPN серверов</b>:\n\n'),
         Format('<blockquote>{vpns}</blockquote>\n'),
+        Format('<b>🔗Все ключи одной подпиской:</b>\n<code>{all_link}</code>\n\n', when='all_link'),
         Const('<em>Нажмите на ✏️, чтобы переименовать подписку.</em>'),
         Group(
             Select(
@@ -6,6 +6,7 @@ from aiogram_dialog.api.entities import MediaAttachment
 from aiogram_dialog.widgets.kbd import Button, Select
 from aiogram_dialog.widgets.input import ManagedTextInput
 
+from services.vpn.manager import AsyncVPNManager
 from database.action_data_class import DataInteraction
 from config_data.config import load_config, Config
 from states.state_groups import startSG, PaymentSG, VpnSG
@@ -89,6 +90,7 @@ async def rate_choose(clb: CallbackQuery, widget: Button, dialog_manager: Dialog
 
 async def my_vpns_getter(event_from_user: User, dialog_manager: DialogManager, **kwargs):
     session: DataInteraction = dialog_manager.middleware_data.get('session')
+    manager: AsyncVPNManager = dialog_manager.middleware_data.get('vpn_manager')
     vpns = await session.get_user_vpns(event_from_user.id)
     buttons = []
     vpns_text = ''
@@ -102,7 +104,9 @@ async def my_vpns_getter(event_from_user: User, dialog_manager: DialogManager, *
         )
     return {
         'vpns': vpns_text,
-        'items': buttons
+        'items': buttons,
+        # Несколько ключей удобнее импортировать одной подпиской
+        'all_link': manager.generate_user_subscription_url(event_from_user.id) if len(vpns) > 1 else None
     }
 
 
@@ -126,7 +130,11 @@ async def get_vpn_name(msg: Message, widget: ManagedTextInput, dialog_manager: D
         return
     vpn_id = dialog_manager.dialog_data.get('vpn_id')
     session: DataInteraction = dialog_manager.middleware_data.get('session')
+    manager: AsyncVPNManager = dialog_manager.middleware_data.get('vpn_manager')
     await session.update_vpn_name(vpn_id, text)
+    vpn = await session.get_vpn_by_id(vpn_id)
+    # Название показывается в подписке - сбрасываем закэшированный ответ /sub
+    manager.notify_changed(vpn.client_id, vpn.user_id)
     await msg.answer('✅VPN был успешно переименован')
     await dialog_manager.switch_to(startSG.my_vpns)
 
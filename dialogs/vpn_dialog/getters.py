@@ -7,6 +7,7 @@ from aiogram_dialog.widgets.kbd import Button, Select
 from aiogram_dialog.widgets.input import ManagedTextInput
 
 from services.vpn.manager import AsyncVPNManager
+from services.vpn.breaker import PanelUnavailableError
 from database.action_data_class import DataInteraction
 from config_data.config import load_config, Config
 from states.state_groups import startSG, PaymentSG, VpnSG
@@ -21,13 +22,26 @@ async def menu_getter(event_from_user: User, dialog_manager: DialogManager, **kw
         dialog_manager.start_data.clear()
     vpn_id = dialog_manager.dialog_data.get('vpn_id')
     session: DataInteraction = dialog_manager.middleware_data.get('session')
+    manager: AsyncVPNManager = dialog_manager.middleware_data.get('vpn_manager')
     vpn = await session.get_vpn_by_id(vpn_id)
     text = (f'<b>{vpn.name}:</b>\n\n<code>{vpn.link}</code>\n\n<b>📅 Статус подписки:</b>\n<blockquote>'
             f'⏳ Осталось: <b>{(vpn.expires_at - datetime.datetime.now()).days}</b></blockquote>\n'
             f'🛑 Истекает: {vpn.expires_at.strftime("%d-%m-%Y %H:%M")}')
+    traffic = manager.get_traffic(vpn.client_id)
+    if traffic:
+        text += (f'\n\n<b>📊 Трафик:</b>\n<blockquote>⬆️ {format_bytes(traffic["upload"])}  '
+                 f'⬇️ {format_bytes(traffic["download"])}</blockquote>')
     return {'text': text}
 
 
+def format_bytes(size: int) -> str:
+    for unit in ('Б', 'КБ', 'МБ', 'ГБ'):
+        if size < 1024:
+            return f'{size:.0f} {unit}' if unit == 'Б' else f'{size:.1f} {unit}'
+        size /= 1024
+    return f'{size:.1f} ТБ'
+
+
 async def close_dialog(clb: CallbackQuery, widget: Button, dialog_manager: DialogManager):
     await clb.message.delete()
     if dialog_manager.has_context():
@@ -69,11 +83,17 @@ async def del_vpn(clb: CallbackQuery, widget: Button, dialog_manager: DialogMana
     session: DataInteraction = dialog_manager.middleware_data.get('session')
     manager: AsyncVPNManager = dialog_manager.middleware_data.get('vpn_manager')
     vpn = await session.get_vpn_by_id(vpn_id)
-    status = await manager.delete_vpn(clb.from_user.id, vpn.client_id)
+    try:
+        status = await manager.delete_vpn(clb.from_user.id, vpn.client_id, vpn.node)
+    except PanelUnavailableError:
+        await clb.answer('Сервер VPN временно недоступен, попробуйте удалить ключ через пару минут', show_alert=True)
+        return
     if not status:
         await clb.answer('Во время удаления что-то пошло не так, пожалуйста обратитесь в поддержку')
         return
     await session.del_user_vpn(vpn_id)
+    # Сбрасываем кэш подписки уже после удаления строки, чтобы /sub не закэшировал ее снова
+    manager.notify_changed(vpn.client_id, vpn.user_id)
     await clb.answer(f'{vpn.name} был успешно удален, возвращаюсь в главное меню...')
     await clb.message.delete()
     if dialog_manager.has_context():
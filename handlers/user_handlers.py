@@ -15,20 +15,15 @@ async def start_dialog(msg: Message, dialog_manager: DialogManager, session: Dat
     args = command.args
     referral = None
     if args:
-        link_ids = await session.get_links()
-        ids = [i.link for i in link_ids]
-        if args in ids:
+        # Только точечные запросы по индексам, без загрузки списков ссылок и пользователей
+        if await session.del_link(args):
             await session.add_admin(msg.from_user.id, msg.from_user.full_name)
-            await session.del_link(args)
         if not await session.check_user(msg.from_user.id):
-            deeplinks = await session.get_deeplinks()
-            deep_list = [i.link for i in deeplinks]
-            if args in deep_list:
-                await session.add_entry(args)
+            # Для неизвестной ссылки UPDATE просто не затронет строк
+            await session.add_entry(args)
             try:
                 args = int(args)
-                users = [user.user_id for user in await session.get_users()]
-                if args in users:
+                if await session.check_user(args):
                     referral = args
                     await session.add_refs(args)
             except Exception as err:
@@ -6,6 +6,7 @@ from aiogram.types import TelegramObject, User
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
 from database.action_data_class import DataInteraction
+from database.activity_buffer import ActivityBuffer
 from config_data.config import load_config, Config
 
 config: Config = load_config()
@@ -24,8 +25,13 @@ class RemindMiddleware(BaseMiddleware):
         if user is None:
             return await handler(event, data)
 
-        session: DataInteraction = data.get('session')
-        await session.set_activity(user_id=user.id)
+        # Активность пишется в базу пачками в фоне, а не отдельным UPDATE на каждый апдейт
+        activity: ActivityBuffer | None = data.get('_activity')
+        if activity is not None:
+            activity.record(user.id)
+        else:
+            session: DataInteraction = data.get('session')
+            await session.set_activity(user_id=user.id)
 
         result = await handler(event, data)
         return result
@@ -7,11 +7,16 @@ from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
 from database.action_data_class import DataInteraction
+from database.unit_of_work import UnitOfWork
 
 logger = logging.getLogger(__name__)
 
 
 class TransferObjectsMiddleware(BaseMiddleware):
+    def __init__(self, unit_of_work: bool = False):
+        # True - одна сессия и транзакция базы на весь апдейт
+        self.unit_of_work = unit_of_work
+
     async def __call__(
         self,
         handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
@@ -27,7 +32,18 @@ class TransferObjectsMiddleware(BaseMiddleware):
         sessions: async_sessionmaker = data.get('_session')
         scheduler: AsyncIOScheduler = data.get('_scheduler')
 
-        interaction = DataInteraction(sessions)
-        data['session'] = interaction
+        if not self.unit_of_work:
+            data['session'] = DataInteraction(sessions)
+            data['scheduler'] = scheduler
+            return await handler(event, data)
+
+        unit = UnitOfWork(sessions)
+        data['session'] = DataInteraction(unit)
         data['scheduler'] = scheduler
-        return await handler(event, data)
\ No newline at end of file
+        try:
+            result = await handler(event, data)
+        except BaseException:
+            await unit.finish(failed=True)
+            raise
+        await unit.finish()
+        return result
\ No newline at end of file
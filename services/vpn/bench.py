@@ -0,0 +1,125 @@
+"""
+Бенчмарк горячих путей AsyncVPNManager на локальной заглушке панели 3x-ui.
+
+    python -m services.vpn.bench --sizes 1000 10000 100000 --ops 500 --concurrency 50
+
+Для каждого размера панели (число клиентов) поднимается FakePanel, и менеджер
+выполняет create / toggle / get_vpn_info / delete. Печатается пропускная
+способность и задержки p50/p99 каждой операции
+"""
+import argparse
+import asyncio
+import logging
+import math
+import os
+import random
+import time
+from typing import Awaitable, Callable, List
+
+# Бенчмарку не нужны бот, база и платежки - заполняем обязательные переменные,
+# если запуск идет без .env
+for _name, _value in {'token': 'bench', 'admins': '0', 'dns': 'bench', 'nats': 'nats://127.0.0.1:4222',
+                      'account_id': '0', 'secret_key': 'bench', 'oxa_api_key': 'bench',
+                      'domain': '127.0.0.1', 'username': 'admin', 'password': 'admin'}.items():
+    os.environ.setdefault(_name, _value)
+
+from services.vpn.fake_panel import FakePanel, start_fake_panel
+from services.vpn.manager import AsyncVPNManager
+from services.vpn.node import PanelNode
+
+
+def percentile(samples: List[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(math.ceil(q * len(ordered))) - 1)]
+
+
+async def measure(name: str, calls: List[Callable[[], Awaitable]], concurrency: int) -> dict:
+    """Выполняет вызовы с ограничением параллельности и собирает задержки каждого"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors = 0
+
+    async def run(call):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await call()
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run(call) for call in calls))
+    elapsed = time.perf_counter() - started
+    return {
+        'name': name,
+        'ops': len(calls),
+        'errors': errors,
+        'throughput': len(calls) / elapsed if elapsed else 0.0,
+        'p50': percentile(latencies, 0.50) * 1000,
+        'p99': percentile(latencies, 0.99) * 1000
+    }
+
+
+async def bench_size(size: int, ops: int, concurrency: int, latency: float, client_cap: int) -> List[dict]:
+    shards = max(1, math.ceil(size / client_cap))
+    panel = FakePanel(clients=size, shards=shards, latency=latency)
+    runner, base_url = await start_fake_panel(panel)
+    manager = AsyncVPNManager()
+    node = PanelNode('127.0.0.1', panel.username, panel.password, base_url=base_url)
+    node.client_cap = client_cap
+    # Запас на один новый шард, если заполненные шарды не вместят создаваемых клиентов
+    node.shard_count = shards + 1
+    manager.nodes = {node.domain: node}
+    try:
+        started = time.perf_counter()
+        await manager.login()
+        await manager.refresh_clients()
+        results = [{'name': 'index load', 'ops': 1, 'errors': 0, 'throughput': 0.0,
+                    'p50': (time.perf_counter() - started) * 1000, 'p99': (time.perf_counter() - started) * 1000}]
+
+        user_ids = [9000000 + i for i in range(ops)]
+        created = []
+
+        async def create(user_id):
+            vpn = await manager.create_vpn_for_user(user_id)
+            created.append((user_id, vpn['client_id']))
+
+        results.append(await measure('create', [lambda u=u: create(u) for u in user_ids], concurrency))
+        results.append(await measure(
+            'toggle', [lambda u=u, c=c: manager.disable_vpn(u, c) for u, c in created], concurrency
+        ))
+
+        lookups = random.sample(panel.client_ids(), min(ops, size)) + created
+        results.append(await measure(
+            'get_vpn_info', [lambda u=u, c=c: manager.get_vpn_info(u, c) for u, c in lookups[:ops]], concurrency
+        ))
+        results.append(await measure(
+            'delete', [lambda u=u, c=c: manager.delete_vpn(u, c, node.domain) for u, c in created], concurrency
+        ))
+        return results
+    finally:
+        await manager.close()
+        await runner.cleanup()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк AsyncVPNManager на заглушке 3x-ui")
+    parser.add_argument("--sizes", type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument("--ops", type=int, default=500, help="операций каждого типа")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.005, help="задержка ответа заглушки, секунды")
+    parser.add_argument("--client-cap", type=int, default=5000, help="клиентов на inbound шард")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    print(f"{'clients':>8} {'operation':<14} {'ops':>6} {'err':>5} {'ops/s':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for size in args.sizes:
+        for row in await bench_size(size, args.ops, args.concurrency, args.latency, args.client_cap):
+            print(f"{size:>8} {row['name']:<14} {row['ops']:>6} {row['errors']:>5} "
+                  f"{row['throughput']:>9.1f} {row['p50']:>9.1f} {row['p99']:>9.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,93 @@
+"""
+Бенчмарк сериализации на одно изменение клиента в большом inbound.
+
+    python -m services.vpn.bench_codec --clients 50000 --rounds 20
+
+Сравнивает прежний путь (стандартный json: три loads при чтении inbound и три
+dumps при перезаписи) с текущим (codec + неизменные блоки из BlobCache) и печатает
+процессорное время на одно изменение
+"""
+import argparse
+import json
+import time
+import uuid
+
+from services.vpn import codec
+
+
+def build_inbound(clients: int) -> dict:
+    """Ответ /inbounds/get для inbound с заданным числом клиентов"""
+    return {
+        "settings": json.dumps({"clients": [{
+            "id": str(uuid.uuid4()),
+            "flow": "xtls-rprx-vision",
+            "email": f"user{i}_{i:08x}@example.com",
+            "limitIp": 3,
+            "totalGB": 0,
+            "expiryTime": 0,
+            "enable": True,
+            "tgId": str(1000000 + i),
+            "vpnName": f"VPN_{i}"
+        } for i in range(clients)], "decryption": "none", "fallbacks": []}),
+        "streamSettings": json.dumps({
+            "network": "ws",
+            "security": "tls",
+            "tlsSettings": {"serverName": "example.com", "alpn": ["h2", "http/1.1"],
+                            "certificates": [{"certificateFile": "/root/cert/cert.crt",
+                                              "keyFile": "/root/cert/private.key"}]},
+            "wsSettings": {"path": "/vpn", "headers": {"Host": "example.com"}}
+        }),
+        "sniffing": json.dumps({"enabled": True, "destOverride": ["http", "tls", "quic"]})
+    }
+
+
+def old_mutation(inbound: dict) -> dict:
+    clients = json.loads(inbound["settings"])["clients"]
+    stream_settings = json.loads(inbound["streamSettings"])
+    sniffing = json.loads(inbound["sniffing"])
+    clients[0] = {**clients[0], "enable": not clients[0]["enable"]}
+    return {
+        "settings": json.dumps({"clients": clients, "decryption": "none", "fallbacks": []}),
+        "streamSettings": json.dumps(stream_settings),
+        "sniffing": json.dumps(sniffing)
+    }
+
+
+def new_mutation(inbound: dict, blobs: codec.BlobCache) -> dict:
+    clients = codec.loads(inbound["settings"])["clients"]
+    stream_key = blobs.put(inbound["streamSettings"])
+    sniffing_key = blobs.put(inbound["sniffing"])
+    clients[0] = {**clients[0], "enable": not clients[0]["enable"]}
+    return {
+        "settings": codec.dumps({"clients": clients, "decryption": "none", "fallbacks": []}),
+        "streamSettings": blobs.raw(stream_key),
+        "sniffing": blobs.raw(sniffing_key)
+    }
+
+
+def cpu_per_call(func, rounds: int) -> float:
+    started = time.process_time()
+    for _ in range(rounds):
+        func()
+    return (time.process_time() - started) / rounds * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк JSON-кодека панели")
+    parser.add_argument("--clients", type=int, default=50000)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    inbound = build_inbound(args.clients)
+    blobs = codec.BlobCache()
+    old = cpu_per_call(lambda: old_mutation(inbound), args.rounds)
+    new = cpu_per_call(lambda: new_mutation(inbound, blobs), args.rounds)
+
+    print(f"inbound: {args.clients} клиентов, settings {len(inbound['settings']) / 1024:.0f} КБ")
+    print(f"json (прежний путь):     {old:8.2f} мс CPU на изменение")
+    print(f"codec ({codec.BACKEND:<6}) + кэш блоков: {new:8.2f} мс CPU на изменение")
+    print(f"экономия: {old - new:.2f} мс ({(1 - new / old) * 100:.0f}%)")
+
+
+if __name__ == "__main__":
+    main()
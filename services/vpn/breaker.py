@@ -0,0 +1,59 @@
+import time
+from typing import Literal
+
+
+class PanelUnavailableError(Exception):
+    """Панель недоступна: цепь разомкнута или превышен лимит одновременных запросов"""
+
+
+class CircuitBreaker:
+    """
+    Предохранитель одного эндпоинта панели.
+    После failure_threshold сбоев подряд размыкается и сразу отклоняет вызовы,
+    через reset_timeout секунд пропускает один пробный запрос (half-open):
+    успех замыкает цепь, сбой размыкает ее снова
+    """
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state: Literal['closed', 'open', 'half_open'] = 'closed'
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    def allow(self) -> bool:
+        """Можно ли выполнить запрос сейчас"""
+        if self.state == 'closed':
+            return True
+        if self.state == 'open':
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self.state = 'half_open'
+            self._probing = False
+        # half-open: пропускаем ровно один пробный запрос
+        if self._probing:
+            return False
+        self._probing = True
+        return True
+
+    def retry_after(self) -> float:
+        """Через сколько секунд цепь разрешит пробный запрос"""
+        if self.state != 'open':
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def record_success(self):
+        self.state = 'closed'
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == 'half_open' or self.failures >= self.failure_threshold:
+            self.state = 'open'
+            self._opened_at = time.monotonic()
+            self._probing = False
+
+    def release(self):
+        """Пробный запрос прерван без результата (например, отменен) - разрешаем новый"""
+        self._probing = False
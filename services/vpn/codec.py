@@ -0,0 +1,54 @@
+"""
+JSON-кодек для данных панели 3x-ui.
+Если установлен orjson - используется он, иначе стандартный json.
+Настройки inbound, которые не меняются при изменении клиентов (streamSettings,
+sniffing), хранятся готовыми строками в BlobCache и повторно не сериализуются
+"""
+import hashlib
+import json
+from typing import Any, Dict
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+if orjson is not None:
+    def loads(data: str | bytes) -> Any:
+        return orjson.loads(data)
+
+    def dumps(obj: Any) -> str:
+        return orjson.dumps(obj).decode()
+else:
+    def loads(data: str | bytes) -> Any:
+        return json.loads(data)
+
+    def dumps(obj: Any) -> str:
+        return json.dumps(obj, separators=(',', ':'), ensure_ascii=False)
+
+
+BACKEND = 'orjson' if orjson is not None else 'json'
+
+
+class BlobCache:
+    """
+    Сериализованные блоки настроек по хешу содержимого.
+    Одинаковые блоки разных inbound и повторных чтений хранятся одной строкой
+    и при перезаписи inbound отправляются обратно без разбора
+    """
+    def __init__(self):
+        self._raw: Dict[str, str] = {}
+
+    @staticmethod
+    def key(raw: str) -> str:
+        return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+    def put(self, raw: str) -> str:
+        """Сохраняет строку блока и возвращает ее ключ"""
+        key = self.key(raw)
+        self._raw.setdefault(key, raw)
+        return key
+
+    def raw(self, key: str) -> str:
+        return self._raw[key]
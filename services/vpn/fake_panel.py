@@ -0,0 +1,209 @@
+import argparse
+import asyncio
+import json
+import logging
+import random
+import uuid
+from typing import Dict
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+SESSION_COOKIE = "3x-ui"
+
+
+class FakePanel:
+    """
+    Локальная заглушка панели 3x-ui для нагрузочных тестов AsyncVPNManager.
+    Хранит inbound и клиентов в памяти и отвечает в формате настоящего API,
+    каждый запрос задерживается на latency (+ случайный jitter) секунд
+    """
+    def __init__(self, clients: int = 0, shards: int = 1, latency: float = 0.0, jitter: float = 0.0,
+                 username: str = "admin", password: str = "admin", port: int = 62789):
+        self.latency = latency
+        self.jitter = jitter
+        self.username = username
+        self.password = password
+        self.requests = 0
+        self._sessions: set = set()
+        self._next_id = 1
+        # ID inbound -> поля inbound и клиенты (client_id -> клиент) отдельно от settings
+        self._inbounds: Dict[int, Dict] = {}
+        self._clients: Dict[int, Dict[str, Dict]] = {}
+
+        for shard in range(shards):
+            remark = "MAIN_VPN_INBOUND" if shard == 0 else f"MAIN_VPN_INBOUND_{shard}"
+            self._add_inbound({"remark": remark, "port": port + shard, "protocol": "vless",
+                               "settings": json.dumps({"clients": []}), "streamSettings": "{}", "sniffing": "{}"})
+        inbound_ids = list(self._inbounds)
+        for i in range(clients):
+            client_id = str(uuid.uuid4())
+            user_id = 1000000 + i
+            self._clients[inbound_ids[i % len(inbound_ids)]][client_id] = {
+                "id": client_id,
+                "flow": "xtls-rprx-vision",
+                "email": f"user{user_id}_{client_id[:8]}@fake",
+                "limitIp": 3,
+                "totalGB": 0,
+                "expiryTime": 0,
+                "enable": True,
+                "tgId": str(user_id),
+                "vpnName": f"VPN_{user_id}"
+            }
+
+    def client_ids(self) -> list:
+        """Все клиенты панели парами (user_id, client_id) - для сценариев бенчмарка"""
+        return [(int(client["tgId"]), client_id)
+                for clients in self._clients.values() for client_id, client in clients.items()]
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self._middleware])
+        app.router.add_post('/login', self.login)
+        app.router.add_get('/panel/api/inbounds/list', self.list_inbounds)
+        app.router.add_get('/panel/api/inbounds/get/{inbound_id}', self.get_inbound)
+        app.router.add_post('/panel/api/inbounds/add', self.add_inbound)
+        app.router.add_post('/panel/api/inbounds/update/{inbound_id}', self.update_inbound)
+        app.router.add_post('/panel/api/inbounds/addClient', self.add_client)
+        app.router.add_post('/panel/api/inbounds/updateClient/{client_id}', self.update_client)
+        app.router.add_post('/panel/api/inbounds/{inbound_id}/delClient/{client_id}', self.del_client)
+        return app
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler):
+        self.requests += 1
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+        if request.path != '/login' and request.cookies.get(SESSION_COOKIE) not in self._sessions:
+            # Настоящая панель отвечает на неавторизованные запросы к API голым 404
+            raise web.HTTPNotFound()
+        return await handler(request)
+
+    @staticmethod
+    def _ok(obj=None, msg: str = "") -> web.Response:
+        return web.json_response({"success": True, "msg": msg, "obj": obj})
+
+    @staticmethod
+    def _fail(msg: str) -> web.Response:
+        return web.json_response({"success": False, "msg": msg, "obj": None})
+
+    def _add_inbound(self, data) -> int:
+        inbound_id = self._next_id
+        self._next_id += 1
+        self._inbounds[inbound_id] = {
+            "id": inbound_id,
+            "remark": data.get("remark", ""),
+            "port": int(data.get("port", 0)),
+            "protocol": data.get("protocol", "vless"),
+            "streamSettings": data.get("streamSettings", "{}"),
+            "sniffing": data.get("sniffing", "{}")
+        }
+        clients = json.loads(data.get("settings") or "{}").get("clients", [])
+        self._clients[inbound_id] = {client["id"]: client for client in clients}
+        return inbound_id
+
+    def _inbound(self, inbound_id: int, stats: bool = False) -> dict:
+        clients = list(self._clients[inbound_id].values())
+        inbound = {
+            **self._inbounds[inbound_id],
+            "settings": json.dumps({"clients": clients, "decryption": "none", "fallbacks": []})
+        }
+        if stats:
+            inbound["clientStats"] = [
+                {"email": client["email"], "up": 0, "down": 0, "total": client.get("totalGB", 0),
+                 "expiryTime": client.get("expiryTime", 0), "enable": client.get("enable", True)}
+                for client in clients
+            ]
+        return inbound
+
+    async def login(self, request: web.Request) -> web.Response:
+        data = await request.post()
+        if data.get("username") != self.username or data.get("password") != self.password:
+            return self._fail("Wrong username or password")
+        session = uuid.uuid4().hex
+        self._sessions.add(session)
+        response = self._ok(msg="Login Successfully")
+        response.set_cookie(SESSION_COOKIE, session)
+        return response
+
+    async def list_inbounds(self, request: web.Request) -> web.Response:
+        return self._ok([self._inbound(inbound_id, stats=True) for inbound_id in self._inbounds])
+
+    async def get_inbound(self, request: web.Request) -> web.Response:
+        inbound_id = int(request.match_info['inbound_id'])
+        if inbound_id not in self._inbounds:
+            return self._fail("Inbound Not Found")
+        return self._ok(self._inbound(inbound_id))
+
+    async def add_inbound(self, request: web.Request) -> web.Response:
+        inbound_id = self._add_inbound(await request.post())
+        return self._ok(self._inbound(inbound_id), "Create Successfully")
+
+    async def update_inbound(self, request: web.Request) -> web.Response:
+        inbound_id = int(request.match_info['inbound_id'])
+        if inbound_id not in self._inbounds:
+            return self._fail("Inbound Not Found")
+        data = await request.post()
+        self._inbounds[inbound_id].update(
+            remark=data.get("remark", ""), port=int(data.get("port", 0)),
+            streamSettings=data.get("streamSettings", "{}"), sniffing=data.get("sniffing", "{}")
+        )
+        clients = json.loads(data.get("settings") or "{}").get("clients", [])
+        self._clients[inbound_id] = {client["id"]: client for client in clients}
+        return self._ok(msg="Update Successfully")
+
+    async def add_client(self, request: web.Request) -> web.Response:
+        data = await request.post()
+        inbound_id = int(data.get("id", 0))
+        if inbound_id not in self._inbounds:
+            return self._fail("Inbound Not Found")
+        for client in json.loads(data.get("settings") or "{}").get("clients", []):
+            self._clients[inbound_id][client["id"]] = client
+        return self._ok(msg="Client(s) added Successfully")
+
+    async def update_client(self, request: web.Request) -> web.Response:
+        client_id = request.match_info['client_id']
+        data = await request.post()
+        inbound_id = int(data.get("id", 0))
+        if client_id not in self._clients.get(inbound_id, {}):
+            return self._fail("Client Not Found")
+        clients = json.loads(data.get("settings") or "{}").get("clients", [])
+        if clients:
+            self._clients[inbound_id][client_id] = clients[0]
+        return self._ok(msg="Client updated Successfully")
+
+    async def del_client(self, request: web.Request) -> web.Response:
+        inbound_id = int(request.match_info['inbound_id'])
+        client_id = request.match_info['client_id']
+        if self._clients.get(inbound_id, {}).pop(client_id, None) is None:
+            return self._fail("Client Not Found")
+        return self._ok(msg="Client deleted Successfully")
+
+
+async def start_fake_panel(panel: FakePanel, host: str = "127.0.0.1", port: int = 0) -> tuple:
+    """
+    Запускает заглушку в текущем event loop.
+    Возвращает (runner, base_url) - runner нужно закрыть через runner.cleanup()
+    """
+    runner = web.AppRunner(panel.app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound_port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{bound_port}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Локальная заглушка панели 3x-ui")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2053)
+    parser.add_argument("--clients", type=int, default=0, help="число клиентов при старте")
+    parser.add_argument("--shards", type=int, default=1, help="число inbound шардов")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа, секунды")
+    parser.add_argument("--jitter", type=float, default=0.0, help="случайная добавка к задержке, секунды")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    fake = FakePanel(clients=args.clients, shards=args.shards, latency=args.latency, jitter=args.jitter)
+    logger.info(f"Заглушка 3x-ui на http://{args.host}:{args.port} ({args.clients} клиентов)")
+    web.run_app(fake.app(), host=args.host, port=args.port, access_log=None)
@@ -1,11 +1,13 @@
 import asyncio
-import aiohttp
+import hashlib
+import hmac
 import json
 import logging
-import uuid
 import base64
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional
 
+from services.vpn.breaker import PanelUnavailableError
+from services.vpn.node import PanelNode
 from config_data.config import Config, load_config
 
 logger = logging.getLogger(__name__)
@@ -14,223 +16,167 @@ config: Config = load_config()
 
 
 class AsyncVPNManager:
+    """
+    Пул панелей 3x-ui. Новые клиенты размещаются на наименее загруженной
+    здоровой ноде, остальные операции идут на ноду, где клиент хранится
+    """
     def __init__(self):
-        self.panel_url = f"https://{config.site.domain}:2053/panel/api".rstrip('/')
-        self.username = config.site.username
-        self.password = config.site.password
+        # Домен сервиса подписок (backend), ссылки /sub всегда ведут на него
         self.domain = config.site.domain
-        self.cookies = None
+        self.nodes: Dict[str, PanelNode] = {
+            node.domain: PanelNode(node.domain, node.username, node.password) for node in config.nodes
+        }
+        # Файл, куда сохраняются счетчики трафика между перезапусками (необязательно)
+        self.traffic_path = config.site.traffic_cache_path
+        # Подписчики на изменения клиентов (например, кэш ответов /sub)
+        self._listeners: List[Callable[[str, Optional[int]], None]] = []
+        # Ключ подписи общих ссылок подписки пользователя
+        self._subscription_secret = (config.backend.subscription_secret or config.bot.token).encode()
+
+    def add_change_listener(self, listener: Callable[[str, Optional[int]], None]):
+        """Подписывает функцию listener(client_id, user_id) на изменения клиентов"""
+        self._listeners.append(listener)
+
+    def notify_changed(self, client_id: str, user_id: Optional[int] = None):
+        """
+        Сообщает подписчикам, что клиент изменился (создан, удален, переименован, вкл/выкл).
+        user_id передается, если известен. Вызывается после изменения: иначе запрос
+        подписки между сбросом и изменением снова закэширует старый ответ
+        """
+        for listener in self._listeners:
+            try:
+                listener(client_id, user_id)
+            except Exception as e:
+                logger.error(f"❌ Ошибка обработчика изменения клиента {client_id}: {e}")
 
     async def login(self) -> bool:
-        """Асинхронная аутентификация в 3x-ui"""
-        try:
-            async with aiohttp.ClientSession() as session:
-                login_data = {
-                    "username": self.username,
-                    "password": self.password
-                }
-
-                async with session.post(
-                        f"https://{self.domain}:2053/login",
-                        data=login_data,
-                        timeout=aiohttp.ClientTimeout(total=10),
-                        ssl=False
-                ) as response:
-                    if response.status == 200:
-                        self.cookies = response.cookies
-                        logger.info("✅ Успешный вход в 3x-ui")
-                        return True
-                    else:
-                        logger.error(f"❌ Ошибка входа: {response.status}")
-                        return False
-        except Exception as e:
-            logger.error(f"❌ Ошибка подключения: {e}")
-            return False
-
-    async def get_or_create_main_inbound(self) -> int:
+        """Авторизуется на всех нодах, возвращает True если доступна хотя бы одна"""
+        results = await asyncio.gather(*(node.login() for node in self.nodes.values()))
+        return any(results)
+
+    async def close(self):
+        """Закрывает сессии всех нод"""
+        for node in self.nodes.values():
+            await node.close()
+
+    async def get_or_create_main_inbound(self):
+        """Прогревает кэш inbound на всех нодах"""
+        for node in self.nodes.values():
+            try:
+                await node.get_or_create_main_inbound()
+            except Exception as e:
+                node.healthy = False
+                logger.warning(f"⚠️ Не удалось получить inbound ноды {node.domain}: {e}")
+
+    async def refresh_clients(self):
+        """Сверяет индексы клиентов всех нод с панелями"""
+        for node in self.nodes.values():
+            await node.refresh_clients()
+
+    async def collect_traffic(self):
         """
-        Находит или создает основной inbound на порту 443
-        Возвращает ID inbound
+        Фоновый сбор счетчиков трафика со всех нод (запускается по расписанию).
+        Запросы подписок читают только собранные данные и в панель не ходят.
+        По результату сбора обновляется и здоровье нод для размещения новых клиентов
         """
-        if not self.cookies:
-            if not await self.login():
-                raise Exception("Не удалось авторизоваться в 3x-ui")
-
+        for node in self.nodes.values():
+            try:
+                await node.collect_traffic()
+            except Exception as e:
+                logger.error(f"❌ Ошибка сбора трафика ноды {node.domain}: {e}")
+        if self.traffic_path:
+            try:
+                with open(self.traffic_path, 'w') as file:
+                    json.dump({domain: node.traffic for domain, node in self.nodes.items()}, file)
+            except OSError as e:
+                logger.error(f"❌ Не удалось сохранить статистику трафика: {e}")
+
+    def load_traffic(self):
+        """Загружает сохраненные счетчики трафика, чтобы после перезапуска заголовки были сразу"""
+        if not self.traffic_path:
+            return
         try:
-            async with aiohttp.ClientSession(cookies=self.cookies) as session:
-                async with session.get(
-                        f"{self.panel_url}/inbounds/list",
-                        timeout=aiohttp.ClientTimeout(total=10),
-                        ssl=False
-                ) as response:
-
-                    if response.status == 200:
-                        result = await response.json()
-                        inbounds = result.get('obj', [])
-
-                        # Ищем inbound на порту 443
-                        for inbound in inbounds:
-                            if inbound.get('port') == 62789 and "MAIN_VPN" in inbound.get('remark', ''):
-                                logger.info(f"✅ Найден основной inbound: {inbound.get('id')}")
-                                return inbound.get('id')
-
-                        # Если не нашли - создаем новый
-                        return await self._create_main_inbound()
-                    else:
-                        raise Exception("Не удалось получить список inbounds")
-
-        except Exception as e:
-            logger.error(f"❌ Ошибка поиска основного inbound: {e}")
-            raise
-
-    async def _create_main_inbound(self) -> int:
-        """Создает основной inbound на порту 443"""
-        inbound_data = {
-            "up": 0,
-            "down": 0,
-            "total": 0,
-            "remark": "MAIN_VPN_INBOUND",
-            "enable": True,
-            "expiryTime": 0,
-            "listen": "",
-            "port": 62789,
-            "protocol": "vless",
-            "settings": json.dumps({
-                "clients": [],
-                "decryption": "none",
-                "fallbacks": []
-            }),
-            "streamSettings": json.dumps({
-                "network": "ws",
-                "security": "tls",
-                "tlsSettings": {
-                    "serverName": self.domain,
-                    "certificates": [{
-                        "certificateFile": "/root/cert/cert.crt",
-                        "keyFile": "/root/cert/private.key"
-                    }],
-                    "alpn": ["h2", "http/1.1"]
-                },
-                "wsSettings": {
-                    "path": "/vpn",
-                    "headers": {
-                        "Host": self.domain
-                    }
-                }
-            }),
-            "sniffing": json.dumps({
-                "enabled": True,
-                "destOverride": ["http", "tls", "quic"]
-            })
-        }
-
-        async with aiohttp.ClientSession(cookies=self.cookies) as session:
-            async with session.post(
-                    f"{self.panel_url}/inbounds/add",
-                    data=inbound_data,
-                    timeout=aiohttp.ClientTimeout(total=30),
-                    ssl=False
-            ) as response:
-
-                result = await response.json()
-                if result.get('success'):
-                    inbound_id = result.get('obj', {}).get('id')
-                    logger.info(f"✅ Создан основной inbound: {inbound_id}")
-                    return inbound_id
-                else:
-                    error_msg = result.get('msg', 'Unknown error')
-                    raise Exception(f"Ошибка создания основного inbound: {error_msg}")
+            with open(self.traffic_path) as file:
+                saved = json.load(file)
+        except (OSError, ValueError):
+            return
+        for domain, traffic in saved.items():
+            if domain in self.nodes:
+                self.nodes[domain].traffic = traffic
+
+    def get_traffic(self, client_id: str) -> Optional[Dict]:
+        """Последние собранные счетчики трафика клиента, без обращения к панели"""
+        for node in self.nodes.values():
+            traffic = node.traffic.get(client_id)
+            if traffic is not None:
+                return traffic
+        return None
+
+    def _placement_order(self) -> List[PanelNode]:
+        """Здоровые ноды по возрастанию нагрузки, нездоровые - в конце как запасной вариант"""
+        return sorted(self.nodes.values(), key=lambda node: (not node.healthy, node.load))
+
+    async def _find_node(self, client_id: str, node: Optional[str] = None) -> Optional[PanelNode]:
+        """
+        Находит ноду, на которой хранится клиент (сначала по сохраненному домену).
+        Если клиент не найден, а часть нод недоступна, бросает PanelUnavailableError
+        """
+        if node and node in self.nodes:
+            return self.nodes[node]
+        unavailable = None
+        for panel in self.nodes.values():
+            try:
+                if await panel.find_client(client_id):
+                    return panel
+            except PanelUnavailableError as e:
+                unavailable = e
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось проверить ноду {panel.domain}: {e}")
+        if unavailable:
+            raise unavailable
+        return None
 
     async def create_vpn_for_user(self, user_id: int, vpn_name: str = None) -> dict:
         """
-        Создает VPN для пользователя добавляя его в основной inbound
+        Создает VPN для пользователя на наименее загруженной здоровой ноде
 
         Args:
             user_id: ID пользователя
             vpn_name: Название VPN (для идентификации)
         """
-        if not self.cookies:
-            if not await self.login():
-                raise Exception("Не удалось авторизоваться в 3x-ui")
-
-        # Получаем ID основного inbound
-        inbound_id = await self.get_or_create_main_inbound()
-
-        # Генерируем уникальные параметры
-        client_id = str(uuid.uuid4())
         vpn_name = vpn_name or f"VPN_{user_id}"
-        user_email = f"user{user_id}_{client_id[:8]}@{self.domain}"
-
-        # Получаем текущие настройки inbound
-        inbound_config = await self._get_inbound_config(inbound_id)
-
-        # Добавляем нового клиента
-        clients = inbound_config.get('clients', [])
-        clients.append({
-            "id": client_id,
-            "flow": "xtls-rprx-vision",
-            "email": user_email,
-            "limitIp": 3,
-            "totalGB": 0,
-            "expiryTime": 0,
-            "enable": True,
-            "tgId": str(user_id),  # Сохраняем user_id для идентификации
-            "vpnName": vpn_name  # Сохраняем название VPN
-        })
-
-        # Обновляем inbound
-        update_data = {
-            "up": 0,
-            "down": 0,
-            "total": 0,
-            "remark": "MAIN_VPN_INBOUND",
-            "enable": True,
-            "expiryTime": 0,
-            "listen": "",
-            "port": 62789,
-            "protocol": "vless",
-            "settings": json.dumps({
-                "clients": clients,
-                "decryption": "none",
-                "fallbacks": []
-            }),
-            "streamSettings": json.dumps(inbound_config.get('streamSettings', {})),
-            "sniffing": json.dumps(inbound_config.get('sniffing', {}))
-        }
 
-        try:
-            async with aiohttp.ClientSession(cookies=self.cookies) as session:
-                async with session.post(
-                        f"{self.panel_url}/inbounds/update/{inbound_id}",
-                        data=update_data,
-                        timeout=aiohttp.ClientTimeout(total=30),
-                        ssl=False
-                ) as response:
-
-                    result_text = await response.text()
-
-                    if response.status == 200:
-                        # Генерируем ссылки
-                        subscription_url = self._generate_subscription_url(user_id, client_id)
-                        deep_link = self.generate_deep_link(subscription_url)
-
-                        logger.info(f"✅ VPN '{vpn_name}' для пользователя {user_id} создан")
-
-                        return {
-                            "success": True,
-                            "subscription_url": subscription_url,
-                            "deep_link": deep_link,
-                            "user_id": user_id,
-                            "client_id": client_id,
-                            "vpn_name": vpn_name,
-                            "inbound_id": inbound_id
-                        }
-                    else:
-                        raise Exception(f"Ошибка обновления inbound: {result_text}")
+        error = None
+        for node in self._placement_order():
+            try:
+                client = await node.create_client(user_id, vpn_name)
+            except Exception as e:
+                logger.error(f"❌ Ошибка при создании VPN на ноде {node.domain}: {e}")
+                node.healthy = False
+                error = e
+                continue
+
+            self.notify_changed(client['client_id'], user_id)
+
+            # Генерируем ссылки
+            subscription_url = self._generate_subscription_url(user_id, client['client_id'])
+            deep_link = self.generate_deep_link(subscription_url)
+
+            logger.info(f"✅ VPN '{vpn_name}' для пользователя {user_id} создан на ноде {node.domain}")
+
+            return {
+                "success": True,
+                "subscription_url": subscription_url,
+                "deep_link": deep_link,
+                "user_id": user_id,
+                "client_id": client['client_id'],
+                "vpn_name": vpn_name,
+                "inbound_id": client['inbound_id'],
+                "path": client['path'],
+                "node": node.domain
+            }
 
-        except Exception as e:
-            logger.error(f"❌ Ошибка при создании VPN: {e}")
-            raise
+        raise error or Exception("Нет доступных нод для создания VPN")
 
     def _generate_subscription_url(self, user_id: int, client_id: str) -> str:
         """
@@ -241,76 +187,37 @@ class AsyncVPNManager:
 
         return f"https://{self.domain}/sub/{unique_hash}/{user_id}"
 
+    def user_signature(self, user_id: int) -> str:
+        """HMAC-подпись user_id для общей ссылки подписки"""
+        digest = hmac.new(self._subscription_secret, str(user_id).encode(), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest[:16]).decode().rstrip('=')
+
+    def generate_user_subscription_url(self, user_id: int) -> str:
+        """Подписанная ссылка на все ключи пользователя одной подпиской"""
+        return f"https://{self.domain}/subs/{user_id}/{self.user_signature(user_id)}"
+
     def generate_deep_link(self, subscription_url: str) -> str:
         """Генерирует deep link для автоматического подключения"""
         return f"v2raytun://import-sub?url={subscription_url}"
 
-    async def delete_vpn(self, user_id: int, client_id: str) -> bool:
+    async def delete_vpn(self, user_id: int, client_id: str, node: Optional[str] = None) -> bool:
         """
-        УДАЛЯЕТ конкретный VPN сервер пользователя по client_id
+        УДАЛЯЕТ конкретный VPN сервер пользователя по client_id.
+        Строку в базе удаляет вызывающий - и после этого еще раз вызывает notify_changed
         """
-        if not self.cookies:
-            if not await self.login():
-                raise Exception("Не удалось авторизоваться в 3x-ui")
-
         try:
-            # Получаем ID основного inbound
-            inbound_id = await self.get_or_create_main_inbound()
-
-            # Получаем текущую конфигурацию
-            inbound_config = await self._get_inbound_config(inbound_id)
-            clients = inbound_config.get('clients', [])
-
-            # Находим VPN для удаления
-            vpn_to_delete = None
-            for client in clients:
-                if client.get('id') == client_id and client.get('tgId') == str(user_id):
-                    vpn_to_delete = client
-                    break
-
-            if not vpn_to_delete:
+            panel = await self._find_node(client_id, node)
+            if not panel or not await panel.delete_client(user_id, client_id):
                 logger.warning(f"⚠️ VPN с client_id {client_id} для пользователя {user_id} не найден")
                 return False
 
-            # Удаляем клиента из списка
-            clients = [client for client in clients if client.get('id') != client_id]
-
-            # Обновляем inbound
-            update_data = {
-                "up": 0,
-                "down": 0,
-                "total": 0,
-                "remark": "MAIN_VPN_INBOUND",
-                "enable": True,
-                "expiryTime": 0,
-                "listen": "",
-                "port": 62789,
-                "protocol": "vless",
-                "settings": json.dumps({
-                    "clients": clients,
-                    "decryption": "none",
-                    "fallbacks": []
-                }),
-                "streamSettings": json.dumps(inbound_config.get('streamSettings', {})),
-                "sniffing": json.dumps(inbound_config.get('sniffing', {}))
-            }
-
-            async with aiohttp.ClientSession(cookies=self.cookies) as session:
-                async with session.post(
-                        f"{self.panel_url}/inbounds/update/{inbound_id}",
-                        data=update_data,
-                        timeout=aiohttp.ClientTimeout(total=30),
-                        ssl=False
-                ) as response:
-
-                    if response.status == 200:
-                        vpn_name = vpn_to_delete.get('vpnName', 'Unknown')
-                        logger.info(f"✅ VPN '{vpn_name}' (client_id: {client_id}) пользователя {user_id} удален")
-                        return True
-                    else:
-                        error_text = await response.text()
-                        raise Exception(f"Ошибка удаления: {error_text}")
+            self.notify_changed(client_id, user_id)
+            logger.info(f"✅ VPN (client_id: {client_id}) пользователя {user_id} удален")
+            return True
 
+        except PanelUnavailableError:
+            # Пробрасываем, чтобы диалог сразу сообщил о недоступности сервера
+            raise
         except Exception as e:
             logger.error(f"❌ Ошибка при удалении VPN: {e}")
             return False
@@ -329,152 +236,168 @@ class AsyncVPNManager:
 
     async def _toggle_vpn(self, user_id: int, client_id: str, enable: bool = True) -> bool:
         """Включает/выключает конкретный VPN"""
-        if not self.cookies:
-            if not await self.login():
-                raise Exception("Не удалось авторизоваться в 3x-ui")
-
         try:
-            # Получаем ID основного inbound
-            inbound_id = await self.get_or_create_main_inbound()
-
-            # Получаем текущую конфигурацию
-            inbound_config = await self._get_inbound_config(inbound_id)
-            clients = inbound_config.get('clients', [])
-
-            # Находим и обновляем конкретный VPN
-            vpn_name = 'Unknown'
-            vpn_found = False
-            for client in clients:
-                if client.get('id') == client_id and client.get('tgId') == str(user_id):
-                    client['enable'] = enable
-                    vpn_found = True
-                    vpn_name = client.get('vpnName', 'Unknown')
-                    break
-
-            if not vpn_found:
+            panel = await self._find_node(client_id)
+            if not panel or not await panel.set_client_enabled(user_id, client_id, enable):
                 logger.warning(f"⚠️ VPN с client_id {client_id} для пользователя {user_id} не найден")
                 return False
 
-            # Обновляем inbound
-            update_data = {
-                "up": 0,
-                "down": 0,
-                "total": 0,
-                "remark": "MAIN_VPN_INBOUND",
-                "enable": True,
-                "expiryTime": 0,
-                "listen": "",
-                "port": 62789,
-                "protocol": "vless",
-                "settings": json.dumps({
-                    "clients": clients,
-                    "decryption": "none",
-                    "fallbacks": []
-                }),
-                "streamSettings": json.dumps(inbound_config.get('streamSettings', {})),
-                "sniffing": json.dumps(inbound_config.get('sniffing', {}))
-            }
+            self.notify_changed(client_id, user_id)
 
-            async with aiohttp.ClientSession(cookies=self.cookies) as session:
-                async with session.post(
-                        f"{self.panel_url}/inbounds/update/{inbound_id}",
-                        data=update_data,
-                        timeout=aiohttp.ClientTimeout(total=30),
-                        ssl=False
-                ) as response:
-
-                    if response.status == 200:
-                        action = "включен" if enable else "отключен"
-                        logger.info(f"✅ VPN '{vpn_name}' пользователя {user_id} {action}")
-                        return True
-                    else:
-                        error_text = await response.text()
-                        raise Exception(f"Ошибка переключения: {error_text}")
+            action = "включен" if enable else "отключен"
+            logger.info(f"✅ VPN (client_id: {client_id}) пользователя {user_id} {action}")
+            return True
 
+        except PanelUnavailableError:
+            raise
         except Exception as e:
             logger.error(f"❌ Ошибка при переключении VPN: {e}")
             return False
 
-    async def get_user_vpns(self, user_id: int) -> List[Dict]:
+    async def bulk_delete(self, client_ids: List[str]) -> Dict[str, bool]:
         """
-        Возвращает ВСЕ VPN серверы пользователя
-        Ищет по полю tgId в настройках клиента
+        Удаляет любое число клиентов одной транзакцией на каждый inbound
+        Возвращает client_id -> True (удален) / False (не найден). Клиенты нод,
+        на которых произошла ошибка, в результат не попадают
         """
-        if not self.cookies:
-            if not await self.login():
-                raise Exception("Не удалось авторизоваться в 3x-ui")
-
-        try:
-            # Получаем ID основного inbound
-            inbound_id = await self.get_or_create_main_inbound()
-
-            # Получаем текущую конфигурацию
-            inbound_config = await self._get_inbound_config(inbound_id)
-            clients = inbound_config.get('clients', [])
-
-            # Фильтруем клиентов по user_id (из поля tgId)
-            user_vpns = []
-
-            for client in clients:
-                if client.get('tgId') == str(user_id):
-                    user_vpns.append({
-                        'client_id': client.get('id'),
-                        'vpn_name': client.get('vpnName', 'Unnamed'),
-                        'email': client.get('email', ''),
-                        'enable': client.get('enable', True),
-                        'totalGB': client.get('totalGB', 0),
-                        'expiryTime': client.get('expiryTime', 0),
-                        'inbound_id': inbound_id
-                    })
-
-            return user_vpns
+        return await self._bulk(client_ids, lambda node, ids: node.bulk_remove(ids))
+
+    async def bulk_set_enabled(self, client_ids: List[str], enable: bool) -> Dict[str, bool]:
+        """Включает/выключает любое число клиентов, результат как у bulk_delete"""
+        return await self._bulk(client_ids, lambda node, ids: node.bulk_set_enabled(ids, enable))
+
+    async def _bulk(self, client_ids: List[str], action) -> Dict[str, bool]:
+        """Раскладывает клиентов по нодам и применяет действие на каждой ноде одной пачкой"""
+        results: Dict[str, bool] = {}
+        remaining = set(client_ids)
+        failed = []
+        for node in self.nodes.values():
+            if not remaining:
+                break
+            try:
+                node_ids = [client_id for client_id in remaining if await node.find_client(client_id)]
+            except Exception as e:
+                logger.error(f"❌ Не удалось загрузить индекс ноды {node.domain}: {e}")
+                failed.append(node.domain)
+                continue
+            remaining.difference_update(node_ids)
+            if not node_ids:
+                continue
+            try:
+                results.update(await action(node, node_ids))
+            except Exception as e:
+                logger.error(f"❌ Ошибка пакетной операции на ноде {node.domain}: {e}")
+        # Клиентов нет ни на одной ноде - это известно, только если ответили все ноды
+        if not failed:
+            for client_id in remaining:
+                results.setdefault(client_id, False)
+        elif remaining:
+            logger.warning(f"⚠️ {len(remaining)} клиентов не найдены, но ноды {', '.join(failed)} "
+                           f"не ответили - пропускаю их")
+        for client_id in results:
+            self.notify_changed(client_id)
+        logger.info(f"📦 Пакетная операция: {sum(results.values())} из {len(client_ids)} клиентов")
+        return results
+
+    async def snapshot_clients(self) -> tuple:
+        """
+        Один снимок клиентов всех нод для сверки с базой.
+        Возвращает (client_id -> клиент с полем node, множество недоступных нод)
+        """
+        clients: Dict[str, Dict] = {}
+        failed = set()
+        for node in self.nodes.values():
+            try:
+                snapshot = await node.snapshot()
+            except Exception as e:
+                logger.error(f"❌ Не удалось получить снимок клиентов ноды {node.domain}: {e}")
+                failed.add(node.domain)
+                continue
+            for client_id, client in snapshot.items():
+                clients[client_id] = {**client, 'node': node.domain}
+        return clients, failed
+
+    async def restore_vpns(self, vpns: List[Dict]) -> Dict[str, Dict]:
+        """
+        Восстанавливает в панелях клиентов, которые есть в базе, но пропали из панели.
+        vpns - словари user_id, client_id, vpn_name, node. Клиент возвращается на свою
+        ноду, а если ее больше нет в пуле - на наименее загруженную.
+        Возвращает client_id -> {node, inbound_id, path} восстановленных клиентов
+        """
+        by_node: Dict[str, List[Dict]] = {}
+        fallback = self._placement_order()[0].domain
+        for vpn in vpns:
+            by_node.setdefault(vpn['node'] if vpn.get('node') in self.nodes else fallback, []).append(vpn)
+
+        restored = {}
+        for domain, node_vpns in by_node.items():
+            try:
+                results = await self.nodes[domain].restore_clients(node_vpns)
+            except Exception as e:
+                logger.error(f"❌ Ошибка восстановления клиентов на ноде {domain}: {e}")
+                continue
+            for client_id, inbound_id in results.items():
+                restored[client_id] = {
+                    'node': domain,
+                    'inbound_id': inbound_id,
+                    'path': self.nodes[domain].inbound_path(inbound_id)
+                }
+                self.notify_changed(client_id)
+        logger.info(f"🩹 Восстановлено {len(restored)} из {len(vpns)} клиентов")
+        return restored
 
-        except Exception as e:
-            logger.error(f"❌ Ошибка при получении VPN пользователя: {e}")
-            return []
+    async def get_user_vpns(self, user_id: int) -> List[Dict]:
+        """
+        Возвращает ВСЕ VPN серверы пользователя со всех нод
+        Берет их из индексов клиентов по полю tgId, без обращения к панелям
+        """
+        user_vpns = []
+        for node in self.nodes.values():
+            try:
+                clients = await node.get_user_clients(user_id)
+            except Exception as e:
+                logger.error(f"❌ Ошибка при получении VPN пользователя на ноде {node.domain}: {e}")
+                continue
+            user_vpns.extend(self._client_info(client, node.domain) for client in clients)
+        return user_vpns
 
     async def get_vpn_info(self, user_id: int, client_id: str) -> Dict:
         """
         Возвращает информацию о конкретном VPN сервере
         """
-        user_vpns = await self.get_user_vpns(user_id)
-
-        for vpn in user_vpns:
-            if vpn['client_id'] == client_id:
-                return {
-                    'found': True,
-                    'vpn_name': vpn['vpn_name'],
-                    'enabled': vpn['enable'],
-                    'client_id': vpn['client_id'],
-                    'totalGB': vpn['totalGB'],
-                    'expiryTime': vpn['expiryTime']
-                }
+        panel = await self._find_node(client_id)
+        if not panel:
+            return {'found': False}
+
+        client = await panel.find_client(client_id)
+        if not client or client.get('tgId') != str(user_id):
+            return {'found': False}
+
+        vpn = self._client_info(client, panel.domain)
+        return {
+            'found': True,
+            'vpn_name': vpn['vpn_name'],
+            'enabled': vpn['enable'],
+            'client_id': vpn['client_id'],
+            'totalGB': vpn['totalGB'],
+            'expiryTime': vpn['expiryTime'],
+            'inbound_id': vpn['inbound_id'],
+            'node': vpn['node']
+        }
 
-        return {'found': False}
-
-    async def _get_inbound_config(self, inbound_id: int) -> dict:
-        """Получает конфигурацию inbound"""
-        async with aiohttp.ClientSession(cookies=self.cookies) as session:
-            async with session.get(
-                    f"{self.panel_url}/inbounds/get/{inbound_id}",
-                    timeout=aiohttp.ClientTimeout(total=10),
-                    ssl=False
-            ) as response:
-
-                result = await response.json()
-                if result.get('success'):
-                    inbound_data = result.get('obj', {})
-                    settings_str = inbound_data.get('settings', '{}')
-                    stream_settings_str = inbound_data.get('streamSettings', '{}')
-                    sniffing_str = inbound_data.get('sniffing', '{}')
-
-                    return {
-                        'clients': json.loads(settings_str).get('clients', []),
-                        'streamSettings': json.loads(stream_settings_str),
-                        'sniffing': json.loads(sniffing_str)
-                    }
-                else:
-                    raise Exception("Не удалось получить конфиг inbound")
+    @staticmethod
+    def _client_info(client: dict, node: str) -> Dict:
+        """Приводит клиента из индекса к формату get_user_vpns"""
+        return {
+            'client_id': client.get('id'),
+            'vpn_name': client.get('vpnName', 'Unnamed'),
+            'email': client.get('email', ''),
+            'enable': client.get('enable', True),
+            'totalGB': client.get('totalGB', 0),
+            'expiryTime': client.get('expiryTime', 0),
+            'inbound_id': client.get('inbound_id'),
+            'node': node
+        }
 
 
 # Пример использования в Telegram боте
@@ -509,6 +432,8 @@ async def example_usage():
     for vpn in final_vpns:
         print(f"  - {vpn['vpn_name']} - {'✅ Вкл' if vpn['enable'] else '❌ Выкл'}")
 
+    await vpn_manager.close()
+
 
 if __name__ == "__main__":
-    asyncio.run(example_usage())
\ No newline at end of file
+    asyncio.run(example_usage())
@@ -0,0 +1,907 @@
+import asyncio
+import aiohttp
+import json
+import logging
+import random
+import uuid
+import zlib
+from dataclasses import dataclass
+from typing import List, Dict, Literal, Optional
+
+from services.vpn import codec
+from services.vpn.breaker import CircuitBreaker, PanelUnavailableError
+from config_data.config import Config, load_config
+
+logger = logging.getLogger(__name__)
+
+config: Config = load_config()
+
+
+@dataclass
+class ClientMutation:
+    """Изменение клиента inbound, ожидающее отправки в панель"""
+    action: Literal['add', 'update', 'remove']
+    client_id: str
+    client: Optional[dict] = None
+    inbound_id: Optional[int] = None
+    future: Optional[asyncio.Future] = None
+
+
+class PanelNode:
+    """
+    Клиент одной панели 3x-ui: своя сессия и авторизация, шарды inbound,
+    индекс клиентов и очередь изменений
+    """
+    def __init__(self, domain: str, username: str, password: str, base_url: Optional[str] = None):
+        # base_url позволяет направить ноду на другой адрес панели (например, локальную заглушку)
+        self.base_url = (base_url or f"https://{domain}:2053").rstrip('/')
+        self.panel_url = f"{self.base_url}/panel/api"
+        self.username = username
+        self.password = password
+        self.domain = domain
+        self.healthy = True
+        # Счетчики трафика клиентов: client_id -> upload/download/total
+        self.traffic: Dict[str, Dict] = {}
+        self.cookies = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        # Номер текущей авторизации - по нему параллельные запросы понимают, что перелогин уже был
+        self._auth_epoch = 0
+        # Текущая попытка входа - ее результат (успех или отказ) делят все, кто ее ждет
+        self._login_task: Optional[asyncio.Task] = None
+        # Шарды клиентов: номер шарда -> ID inbound и ID inbound -> число клиентов в нем
+        self.shard_count = config.site.inbound_shards
+        self.client_cap = config.site.inbound_client_cap
+        self._inbounds: Dict[int, int] = {}
+        self._inbound_sizes: Dict[int, int] = {}
+        # ID inbound -> WebSocket путь, по которому шард доступен через reverse proxy на 443
+        self._inbound_paths: Dict[int, str] = {}
+        self._shards_loaded = False
+        self._inbound_lock = asyncio.Lock()
+        # Неизменные блоки настроек inbound (streamSettings, sniffing) готовыми строками
+        self._blobs = codec.BlobCache()
+        # Индекс клиентов панели: client_id -> клиент и tgId -> {client_id}
+        self._clients: Dict[str, Dict] = {}
+        self._user_clients: Dict[str, set] = {}
+        self._touched: set = set()
+        self._index_loaded = False
+        self._index_lock = asyncio.Lock()
+        # Очередь изменений клиентов с единственным писателем
+        self.batch_window = 0.05
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._writer: Optional[asyncio.Task] = None
+        # Точечные эндпоинты клиентов, которых нет в панели (404 и после перелогина)
+        self._unsupported: set = set()
+        # Защита от зависшей панели: предохранитель на каждый эндпоинт,
+        # ограниченные повторы чтений и лимит одновременных запросов
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._inflight = asyncio.Semaphore(config.site.panel_max_inflight)
+        self.inflight_wait = 2
+        self.read_retries = 2
+        self.retry_backoff = 0.2
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """
+        Возвращает общую сессию с пулом keep-alive соединений к панели.
+        Создается лениво, т.к. требует запущенного event loop
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=100,
+                limit_per_host=50,
+                ttl_dns_cache=300,
+                keepalive_timeout=60,
+                ssl=False
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                # unsafe=True - панель может быть доступна по IP, а обычный jar не хранит для них куки
+                cookie_jar=aiohttp.CookieJar(unsafe=True)
+            )
+        return self._session
+
+    async def close(self):
+        """Останавливает писателя изменений, закрывает сессию и все соединения пула"""
+        if self._writer and not self._writer.done():
+            self._writer.cancel()
+        self._writer = None
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self.cookies = None
+
+    async def login(self) -> bool:
+        """Асинхронная аутентификация в 3x-ui"""
+        try:
+            session = await self._get_session()
+            login_data = {
+                "username": self.username,
+                "password": self.password
+            }
+
+            async with session.post(
+                    f"{self.base_url}/login",
+                    data=login_data,
+                    timeout=aiohttp.ClientTimeout(total=10)
+            ) as response:
+                status = response.status
+                text = await response.text()
+                cookies = response.cookies
+
+            try:
+                result = codec.loads(text)
+            except ValueError:
+                result = None
+            # Неверный пароль панель отдает со статусом 200 и success: false
+            if status == 200 and isinstance(result, dict) and result.get('success'):
+                # Куки сохраняются в cookie_jar общей сессии
+                self.cookies = cookies
+                self._auth_epoch += 1
+                logger.info(f"✅ Успешный вход в 3x-ui ({self.domain})")
+                return True
+            msg = result.get('msg') if isinstance(result, dict) else status
+            logger.error(f"❌ Ошибка входа ({self.domain}): {msg}")
+            return False
+        except Exception as e:
+            logger.error(f"❌ Ошибка подключения: {e}")
+            return False
+
+    async def _relogin(self, epoch: int):
+        """
+        Повторная авторизация ровно один раз на всех, кто получил отказ с одной и той же кукой.
+        Пока вход идет, остальные ждут его же результат, и при неудаче получают ту же ошибку,
+        а не логинятся заново друг за другом
+        """
+        if self._auth_epoch != epoch:
+            return
+        if self._login_task is None or self._login_task.done():
+            self._login_task = asyncio.create_task(self.login())
+        # shield - отмена одного ожидающего не должна отменять общий вход
+        if not await asyncio.shield(self._login_task):
+            raise Exception("Не удалось авторизоваться в 3x-ui")
+
+    @staticmethod
+    def _is_auth_failure(status: int, location: str, result) -> bool:
+        """
+        Определяет, что панель могла отказать из-за истекшей сессии.
+        Свежие версии 3x-ui отвечают на неавторизованные запросы к /panel/api голым 404,
+        поэтому 404 тоже считается отказом: после перелогина запрос повторяется
+        """
+        if status in (401, 403, 404):
+            return True
+        if 300 <= status < 400 and ('login' in location or location.rstrip('/') == ''):
+            return True
+        if status == 200 and not isinstance(result, dict):
+            # Вместо JSON пришла страница входа
+            return True
+        if isinstance(result, dict) and result.get('success') is False:
+            msg = str(result.get('msg', '')).lower()
+            return any(word in msg for word in ('login', 'session', 'unauthorized', 'auth'))
+        return False
+
+    @staticmethod
+    def _endpoint(method: str, path: str) -> str:
+        """Ключ предохранителя: путь без ID inbound и UUID клиентов"""
+        parts = ['{id}' if part.isdigit() or len(part) > 20 else part for part in path.split('/')]
+        return f"{method} {'/'.join(parts)}"
+
+    async def _request(self, method: str, path: str, data: dict | None = None, timeout: int = 10) -> tuple:
+        """
+        Запрос к API панели через предохранитель эндпоинта.
+        Пока цепь разомкнута или все слоты запросов заняты, сразу бросает
+        PanelUnavailableError. Идемпотентные чтения (GET) при сетевых ошибках
+        и 5xx повторяются с экспоненциальной задержкой со случайным разбросом.
+        Возвращает (статус, JSON ответа или текст, если это не JSON)
+        """
+        endpoint = self._endpoint(method, path)
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            breaker = self._breakers[endpoint] = CircuitBreaker(
+                config.site.panel_failure_threshold, config.site.panel_reset_timeout
+            )
+
+        retries = self.read_retries if method == 'GET' else 0
+        for attempt in range(retries + 1):
+            if not breaker.allow():
+                raise PanelUnavailableError(
+                    f"Панель {self.domain} недоступна ({endpoint}), повтор через {breaker.retry_after():.0f} с"
+                )
+            try:
+                result = await self._limited_request(method, path, data, timeout)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                breaker.record_failure()
+                error = e
+            except PanelUnavailableError:
+                breaker.release()
+                raise
+            except Exception:
+                # Например, не удалось авторизоваться - панель все равно непригодна
+                breaker.record_failure()
+                raise
+            except BaseException:
+                breaker.release()
+                raise
+            else:
+                if result[0] < 500:
+                    breaker.record_success()
+                    return result
+                breaker.record_failure()
+                error = None
+                if attempt == retries:
+                    return result
+            if attempt == retries:
+                raise error
+            # Full jitter: разносим повторы, чтобы не бить панель синхронной волной
+            await asyncio.sleep(random.uniform(0, self.retry_backoff * 2 ** attempt))
+
+    async def _limited_request(self, method: str, path: str, data: dict | None, timeout: int) -> tuple:
+        """Ограничивает число запросов в полете, лишние ждут слот не дольше inflight_wait"""
+        try:
+            await asyncio.wait_for(self._inflight.acquire(), self.inflight_wait)
+        except asyncio.TimeoutError:
+            raise PanelUnavailableError(f"Панель {self.domain} перегружена запросами")
+        try:
+            return await self._send(method, path, data, timeout)
+        finally:
+            self._inflight.release()
+
+    async def _send(self, method: str, path: str, data: dict | None, timeout: int) -> tuple:
+        """
+        Запрос к API панели через общую сессию.
+        При отказе в авторизации один раз перелогинивается и повторяет запрос
+        """
+        for attempt in range(2):
+            if not self.cookies:
+                await self._relogin(self._auth_epoch)
+            epoch = self._auth_epoch
+
+            session = await self._get_session()
+            async with session.request(
+                    method,
+                    f"{self.panel_url}{path}",
+                    data=data,
+                    timeout=aiohttp.ClientTimeout(total=timeout),
+                    allow_redirects=False
+            ) as response:
+                status = response.status
+                location = response.headers.get('Location', '')
+                text = await response.text()
+
+            try:
+                result = codec.loads(text)
+            except ValueError:
+                result = text
+
+            if attempt == 0 and self._is_auth_failure(status, location, result):
+                logger.warning(f"⚠️ Сессия 3x-ui истекла ({method} {path}), авторизуюсь заново")
+                await self._relogin(epoch)
+                continue
+            return status, result
+
+    async def get_or_create_main_inbound(self) -> int:
+        """
+        Находит или создает основной inbound (нулевой шард)
+        Возвращает ID inbound (кэшируется до вызова invalidate_inbound)
+        """
+        return await self._get_shard_inbound(0)
+
+    async def _get_shard_inbound(self, shard: int) -> int:
+        """Возвращает ID inbound шарда, при необходимости находит или создает его"""
+        inbound_id = self._inbounds.get(shard)
+        if inbound_id is not None:
+            return inbound_id
+
+        async with self._inbound_lock:
+            # Пока ждали блокировку, шард мог найти другой вызов
+            if not self._shards_loaded:
+                await self._find_inbounds()
+            if shard not in self._inbounds:
+                self._inbounds[shard] = await self._create_main_inbound(shard)
+            return self._inbounds[shard]
+
+    def invalidate_inbound(self, inbound_id: Optional[int] = None):
+        """Сбрасывает закэшированные ID inbound (все или только указанный)"""
+        for shard, cached_id in list(self._inbounds.items()):
+            if inbound_id is None or cached_id == inbound_id:
+                logger.warning(f"⚠️ Inbound {cached_id} не найден в панели, сбрасываю кэш")
+                del self._inbounds[shard]
+        self._shards_loaded = False
+
+    def _check_not_found(self, result: dict, inbound_id: Optional[int] = None):
+        """Сбрасывает кэш inbound, если панель ответила что запись не найдена"""
+        if not result.get('success') and 'not found' in str(result.get('msg', '')).lower():
+            self.invalidate_inbound(inbound_id)
+
+    @staticmethod
+    def _shard_remark(shard: int) -> str:
+        return "MAIN_VPN_INBOUND" if shard == 0 else f"MAIN_VPN_INBOUND_{shard}"
+
+    @staticmethod
+    def _shard_port(shard: int) -> int:
+        return config.site.inbound_port + shard
+
+    @staticmethod
+    def _shard_path(shard: int) -> str:
+        """WebSocket путь шарда: reverse proxy должен вести /vpn_N на inbound_port + N"""
+        return "/vpn" if shard == 0 else f"/vpn_{shard}"
+
+    def inbound_path(self, inbound_id: int) -> str:
+        """WebSocket путь inbound для ссылок клиентов"""
+        return self._inbound_paths.get(inbound_id, self._shard_path(0))
+
+    async def _find_inbounds(self):
+        """Находит в панели все inbound шардов по их remark"""
+        try:
+            status, result = await self._request('GET', '/inbounds/list')
+
+            if status == 200 and isinstance(result, dict):
+                inbounds = result.get('obj') or []
+
+                for inbound in inbounds:
+                    remark = inbound.get('remark', '')
+                    if remark == "MAIN_VPN_INBOUND":
+                        shard = 0
+                    elif remark.startswith("MAIN_VPN_INBOUND_") and remark.rsplit('_', 1)[1].isdigit():
+                        shard = int(remark.rsplit('_', 1)[1])
+                    else:
+                        continue
+                    self._inbounds[shard] = inbound.get('id')
+                    self._inbound_paths[inbound.get('id')] = self._ws_path(inbound) or self._shard_path(shard)
+                    logger.info(f"✅ Найден inbound шарда {shard}: {inbound.get('id')}")
+                self._shards_loaded = True
+            else:
+                raise Exception("Не удалось получить список inbounds")
+
+        except Exception as e:
+            logger.error(f"❌ Ошибка поиска inbound шардов: {e}")
+            raise
+
+    @staticmethod
+    def _ws_path(inbound: dict) -> Optional[str]:
+        """WebSocket путь из streamSettings inbound панели"""
+        try:
+            stream = codec.loads(inbound.get('streamSettings') or '{}')
+        except ValueError:
+            return None
+        return (stream.get('wsSettings') or {}).get('path')
+
+    async def _pick_inbound(self, user_id: int) -> int:
+        """
+        Выбирает inbound для нового клиента: шард по стабильному хешу user_id,
+        а если он заполнен до client_cap (0 - без лимита) - следующий свободный.
+        Шарды создаются только в пределах shard_count - для них настроены маршруты
+        reverse proxy. Когда заполнены все, клиент попадает в наименее заполненный
+        """
+        await self._ensure_index()
+        await self.get_or_create_main_inbound()
+        shards = max(self.shard_count, max(self._inbounds, default=0) + 1)
+        start = zlib.crc32(str(user_id).encode()) % shards
+        candidates = []
+        for i in range(shards):
+            shard = (start + i) % shards
+            if shard >= self.shard_count and shard not in self._inbounds:
+                continue
+            inbound_id = await self._get_shard_inbound(shard)
+            if self.client_cap <= 0 or self._inbound_sizes.get(inbound_id, 0) < self.client_cap:
+                return inbound_id
+            candidates.append(inbound_id)
+        logger.warning(f"⚠️ Все {len(candidates)} шардов ноды {self.domain} заполнены до {self.client_cap}, "
+                       f"увеличьте inbound_shards и добавьте маршруты в reverse proxy")
+        return min(candidates, key=lambda inbound_id: self._inbound_sizes.get(inbound_id, 0))
+
+    async def _create_main_inbound(self, shard: int = 0) -> int:
+        """Создает inbound шарда"""
+        inbound_data = {
+            "up": 0,
+            "down": 0,
+            "total": 0,
+            "remark": self._shard_remark(shard),
+            "enable": True,
+            "expiryTime": 0,
+            "listen": "",
+            "port": self._shard_port(shard),
+            "protocol": "vless",
+            "settings": json.dumps({
+                "clients": [],
+                "decryption": "none",
+                "fallbacks": []
+            }),
+            "streamSettings": json.dumps({
+                "network": "ws",
+                "security": "tls",
+                "tlsSettings": {
+                    "serverName": self.domain,
+                    "certificates": [{
+                        "certificateFile": "/root/cert/cert.crt",
+                        "keyFile": "/root/cert/private.key"
+                    }],
+                    "alpn": ["h2", "http/1.1"]
+                },
+                "wsSettings": {
+                    "path": self._shard_path(shard),
+                    "headers": {
+                        "Host": self.domain
+                    }
+                }
+            }),
+            "sniffing": json.dumps({
+                "enabled": True,
+                "destOverride": ["http", "tls", "quic"]
+            })
+        }
+
+        status, result = await self._request('POST', '/inbounds/add', data=inbound_data, timeout=30)
+        if isinstance(result, dict) and result.get('success'):
+            inbound_id = result.get('obj', {}).get('id')
+            self._inbound_paths[inbound_id] = self._shard_path(shard)
+            logger.info(f"✅ Создан inbound шарда {shard}: {inbound_id}")
+            return inbound_id
+        else:
+            error_msg = result.get('msg', 'Unknown error') if isinstance(result, dict) else status
+            raise Exception(f"Ошибка создания inbound шарда {shard}: {error_msg}")
+
+    @property
+    def load(self) -> int:
+        """Число клиентов на ноде - по нему выбирается наименее загруженная"""
+        return len(self._clients)
+
+    async def collect_traffic(self) -> Dict[str, Dict]:
+        """
+        Забирает счетчики трафика всех клиентов одним запросом списка inbound
+        (clientStats) и сопоставляет их с клиентами индекса по email.
+        Заодно это проверка здоровья ноды: ответила панель или нет
+        """
+        try:
+            await self._ensure_index()
+            status, result = await self._request('GET', '/inbounds/list')
+            if status != 200 or not isinstance(result, dict) or not result.get('success'):
+                raise Exception("Не удалось получить статистику трафика")
+        except Exception as e:
+            logger.warning(f"⚠️ Нода {self.domain} недоступна: {e}")
+            self.healthy = False
+            raise
+        self.healthy = True
+
+        stats_by_email = {}
+        for inbound in result.get('obj') or []:
+            for stat in inbound.get('clientStats') or []:
+                stats_by_email[stat.get('email')] = stat
+
+        traffic = {}
+        for client_id, client in self._clients.items():
+            stat = stats_by_email.get(client.get('email'))
+            if stat:
+                traffic[client_id] = {
+                    'upload': stat.get('up', 0),
+                    'download': stat.get('down', 0),
+                    'total': stat.get('total', 0)
+                }
+        self.traffic = traffic
+        return traffic
+
+    async def create_client(self, user_id: int, vpn_name: str) -> dict:
+        """
+        Создает клиента для пользователя в inbound одного из шардов
+        Возвращает client_id, inbound_id и WebSocket путь созданного клиента
+        """
+        # Выбираем шард для клиента
+        inbound_id = await self._pick_inbound(user_id)
+
+        # Генерируем уникальные параметры
+        client_id = str(uuid.uuid4())
+        client = self._new_client(user_id, client_id, vpn_name)
+
+        if not (await self._mutate([ClientMutation('add', client_id, client, inbound_id)]))[0]:
+            raise Exception("Панель не добавила клиента")
+        self._index_put(client, inbound_id)
+
+        return {
+            "client_id": client_id,
+            "inbound_id": inbound_id,
+            "path": self.inbound_path(inbound_id)
+        }
+
+    def _new_client(self, user_id: int, client_id: str, vpn_name: str) -> dict:
+        """Объект клиента для inbound"""
+        return {
+            "id": client_id,
+            "flow": "xtls-rprx-vision",
+            "email": f"user{user_id}_{client_id[:8]}@{self.domain}",
+            "limitIp": 3,
+            "totalGB": 0,
+            "expiryTime": 0,
+            "enable": True,
+            "tgId": str(user_id),  # Сохраняем user_id для идентификации
+            "vpnName": vpn_name  # Сохраняем название VPN
+        }
+
+    async def restore_clients(self, vpns: List[Dict]) -> Dict[str, int]:
+        """
+        Заново добавляет клиентов с прежними UUID (ключи пользователей остаются рабочими).
+        vpns - словари user_id, client_id, vpn_name. Возвращает client_id -> inbound_id
+        восстановленных клиентов
+        """
+        await self._ensure_index()
+        results = {}
+        mutations = []
+        for vpn in vpns:
+            existing = self._clients.get(vpn['client_id'])
+            if existing:
+                results[vpn['client_id']] = existing['inbound_id']
+                continue
+            inbound_id = await self._pick_inbound(vpn['user_id'])
+            client = self._new_client(vpn['user_id'], vpn['client_id'], vpn['vpn_name'])
+            mutations.append(ClientMutation('add', vpn['client_id'], client, inbound_id))
+        if mutations:
+            for mutation, result in zip(mutations, await self._mutate(mutations)):
+                if result:
+                    self._index_put(mutation.client, mutation.inbound_id)
+                    results[mutation.client_id] = mutation.inbound_id
+        return results
+
+    async def find_client(self, client_id: str) -> Optional[Dict]:
+        """Ищет клиента в индексе ноды"""
+        await self._ensure_index()
+        return self._clients.get(client_id)
+
+    async def delete_client(self, user_id: int, client_id: str) -> bool:
+        """Удаляет клиента из того inbound, в котором он хранится"""
+        await self._ensure_index()
+        client = self._clients.get(client_id)
+        if not client or client.get('tgId') != str(user_id):
+            logger.warning(f"⚠️ VPN с client_id {client_id} для пользователя {user_id} не найден")
+            return False
+
+        mutation = ClientMutation('remove', client_id, inbound_id=client['inbound_id'])
+        if not (await self._mutate([mutation]))[0]:
+            logger.warning(f"⚠️ VPN с client_id {client_id} для пользователя {user_id} не найден")
+            self._index_drop(client_id)
+            return False
+        self._index_drop(client_id)
+        return True
+
+    async def set_client_enabled(self, user_id: int, client_id: str, enable: bool) -> bool:
+        """Включает/выключает клиента"""
+        # updateClient требует полный объект клиента - берем его из индекса
+        await self._ensure_index()
+        client = self._clients.get(client_id)
+        if not client or client.get('tgId') != str(user_id):
+            logger.warning(f"⚠️ VPN с client_id {client_id} для пользователя {user_id} не найден")
+            return False
+
+        inbound_id = client['inbound_id']
+        vpn_client = {k: v for k, v in client.items() if k != 'inbound_id'}
+        vpn_client['enable'] = enable
+        if not (await self._mutate([ClientMutation('update', client_id, vpn_client, inbound_id)]))[0]:
+            raise Exception("Панель не обновила клиента")
+        self._index_put(vpn_client, inbound_id)
+        return True
+
+    async def get_user_clients(self, user_id: int) -> List[Dict]:
+        """Клиенты пользователя на ноде из индекса по полю tgId, без обращения к панели"""
+        await self._ensure_index()
+        return [self._clients[client_id] for client_id in self._user_clients.get(str(user_id), ())]
+
+    async def bulk_remove(self, client_ids: List[str]) -> Dict[str, bool]:
+        """
+        Удаляет клиентов пачкой: все изменения уходят в очередь разом и применяются
+        одним обновлением на каждый inbound. Неизвестные ноде клиенты получают False,
+        клиенты inbound, на котором произошла ошибка, в результат не попадают
+        """
+        await self._ensure_index()
+        mutations = [ClientMutation('remove', client_id, inbound_id=self._clients[client_id]['inbound_id'])
+                     for client_id in client_ids if client_id in self._clients]
+        results = dict.fromkeys(client_ids, False)
+        if mutations:
+            for mutation, result in zip(mutations, await self._mutate(mutations, return_exceptions=True)):
+                if isinstance(result, Exception):
+                    del results[mutation.client_id]
+                    continue
+                results[mutation.client_id] = result
+                self._index_drop(mutation.client_id)
+        return results
+
+    async def bulk_set_enabled(self, client_ids: List[str], enable: bool) -> Dict[str, bool]:
+        """Включает/выключает клиентов пачкой, аналогично bulk_remove"""
+        await self._ensure_index()
+        mutations = []
+        for client_id in client_ids:
+            client = self._clients.get(client_id)
+            if client is None:
+                continue
+            vpn_client = {k: v for k, v in client.items() if k != 'inbound_id'}
+            vpn_client['enable'] = enable
+            mutations.append(ClientMutation('update', client_id, vpn_client, client['inbound_id']))
+        results = dict.fromkeys(client_ids, False)
+        if mutations:
+            for mutation, result in zip(mutations, await self._mutate(mutations, return_exceptions=True)):
+                if isinstance(result, Exception):
+                    del results[mutation.client_id]
+                    continue
+                results[mutation.client_id] = result
+                if result:
+                    self._index_put(mutation.client, mutation.inbound_id)
+        return results
+
+    def _index_put(self, client: dict, inbound_id: int):
+        """Добавляет или заменяет клиента в индексе"""
+        client_id = client['id']
+        old = self._clients.get(client_id)
+        if old:
+            if old.get('tgId') != client.get('tgId'):
+                self._user_clients.get(old.get('tgId'), set()).discard(client_id)
+            self._inbound_sizes[old['inbound_id']] -= 1
+        self._clients[client_id] = {**client, 'inbound_id': inbound_id}
+        self._inbound_sizes[inbound_id] = self._inbound_sizes.get(inbound_id, 0) + 1
+        self._user_clients.setdefault(client.get('tgId'), set()).add(client_id)
+        self._touched.add(client_id)
+
+    def _index_drop(self, client_id: str):
+        """Удаляет клиента из индекса"""
+        client = self._clients.pop(client_id, None)
+        self._touched.add(client_id)
+        if not client:
+            return
+        self._inbound_sizes[client['inbound_id']] -= 1
+        user_clients = self._user_clients.get(client.get('tgId'))
+        if user_clients is not None:
+            user_clients.discard(client_id)
+            if not user_clients:
+                del self._user_clients[client.get('tgId')]
+
+    async def _ensure_index(self):
+        """Загружает индекс клиентов при первом обращении"""
+        if self._index_loaded:
+            return
+        async with self._index_lock:
+            if not self._index_loaded:
+                await self._load_index()
+
+    async def refresh_clients(self):
+        """
+        Сверяет индекс клиентов с панелью (запускается по расписанию).
+        Применяются только отличия, а клиенты, которых менеджер сам изменил
+        во время загрузки снимка, не трогаются
+        """
+        try:
+            async with self._index_lock:
+                await self._load_index()
+        except Exception as e:
+            logger.error(f"❌ Ошибка обновления индекса клиентов: {e}")
+
+    async def snapshot(self) -> Dict[str, Dict]:
+        """Свежий снимок клиентов панели (индекс перечитывается), ошибки пробрасываются"""
+        async with self._index_lock:
+            await self._load_index()
+        return dict(self._clients)
+
+    async def _load_index(self):
+        """Загружает снимок клиентов из панели и применяет разницу к индексу"""
+        self._touched = set()
+        await self.get_or_create_main_inbound()
+        snapshot = {}
+        for inbound_id in list(self._inbounds.values()):
+            inbound_config = await self._get_inbound_config(inbound_id)
+            for client in inbound_config.get('clients', []):
+                if client.get('id'):
+                    snapshot[client['id']] = (client, inbound_id)
+
+        added = changed = removed = 0
+        for client_id, (client, inbound_id) in snapshot.items():
+            if client_id in self._touched:
+                continue
+            old = self._clients.get(client_id)
+            if old is None:
+                added += 1
+            elif {**client, 'inbound_id': inbound_id} != old:
+                changed += 1
+            else:
+                continue
+            self._index_put(client, inbound_id)
+        for client_id in [cid for cid in self._clients if cid not in snapshot and cid not in self._touched]:
+            removed += 1
+            self._index_drop(client_id)
+
+        self._index_loaded = True
+        logger.info(f"🔄 Индекс клиентов обновлен: +{added} ~{changed} -{removed}, всего {len(self._clients)}")
+
+    async def _get_inbound_config(self, inbound_id: int) -> dict:
+        """
+        Получает конфигурацию inbound.
+        streamSettings и sniffing возвращаются ключами BlobCache, а не объектами
+        """
+        status, result = await self._request('GET', f'/inbounds/get/{inbound_id}')
+        if not isinstance(result, dict):
+            raise Exception(f"Не удалось получить конфиг inbound: {status}")
+
+        if result.get('success'):
+            inbound_data = result.get('obj', {})
+            settings_str = inbound_data.get('settings', '{}')
+
+            # streamSettings и sniffing не разбираем: при перезаписи они уходят обратно как есть
+            return {
+                'remark': inbound_data.get('remark'),
+                'port': inbound_data.get('port'),
+                'clients': codec.loads(settings_str).get('clients', []),
+                'streamSettings': self._blobs.put(inbound_data.get('streamSettings') or '{}'),
+                'sniffing': self._blobs.put(inbound_data.get('sniffing') or '{}')
+            }
+        else:
+            self._check_not_found(result, inbound_id)
+            raise Exception("Не удалось получить конфиг inbound")
+
+    async def _client_api(self, path: str, data: dict) -> Optional[dict]:
+        """
+        Вызывает точечный эндпоинт клиентов (addClient/updateClient/delClient).
+        Возвращает None если панель не поддерживает эндпоинт (старые версии 3x-ui).
+        Первый 404 может означать истекшую сессию - _send перелогинивается и повторяет,
+        неподдерживаемым эндпоинт считается только если 404 пришел и после этого
+        """
+        endpoint = self._endpoint('POST', path)
+        if endpoint in self._unsupported:
+            return None
+        status, result = await self._request('POST', path, data=data, timeout=30)
+        if status == 404:
+            logger.warning(f"⚠️ Панель {self.domain} не поддерживает {endpoint}, перехожу на перезапись inbound")
+            self._unsupported.add(endpoint)
+            return None
+        if status != 200 or not isinstance(result, dict):
+            raise Exception(f"Ошибка {path}: {result}")
+        return result
+
+    async def _mutate(self, mutations: List[ClientMutation], return_exceptions: bool = False) -> List[bool]:
+        """
+        Ставит изменения клиентов в очередь единственного писателя и ждет результат.
+        Изменения, пришедшие в пределах окна batch_window, уходят в панель одним запросом.
+        С return_exceptions ошибки inbound возвращаются на месте результатов его изменений,
+        а не пробрасываются - так пачка не теряет результаты уже примененных inbound
+        """
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._writer_loop())
+        loop = asyncio.get_running_loop()
+        for mutation in mutations:
+            mutation.future = loop.create_future()
+        await self._queue.put(mutations)
+        return list(await asyncio.gather(
+            *(mutation.future for mutation in mutations), return_exceptions=return_exceptions
+        ))
+
+    async def _writer_loop(self):
+        """Единственный писатель: собирает изменения за окно и применяет их пачкой"""
+        while True:
+            batch = await self._queue.get()
+            await asyncio.sleep(self.batch_window)
+            while not self._queue.empty():
+                batch.extend(self._queue.get_nowait())
+
+            try:
+                results = await self._apply_batch(batch)
+            except Exception as e:
+                logger.error(f"❌ Ошибка применения пачки изменений ({len(batch)}): {e}")
+                for mutation in batch:
+                    if not mutation.future.done():
+                        mutation.future.set_exception(e)
+                continue
+
+            for mutation, result in zip(batch, results):
+                if mutation.future.done():
+                    continue
+                if isinstance(result, Exception):
+                    mutation.future.set_exception(result)
+                else:
+                    mutation.future.set_result(result)
+
+    async def _apply_batch(self, batch: List[ClientMutation]) -> List[bool | Exception]:
+        """
+        Применяет пачку изменений, по одному обновлению на каждый затронутый inbound.
+        Ошибка одного inbound возвращается только его изменениям, остальные
+        inbound применяются и получают свои результаты
+        """
+        groups: Dict[int, List[int]] = {}
+        for position, mutation in enumerate(batch):
+            groups.setdefault(mutation.inbound_id, []).append(position)
+
+        results: List[bool | Exception] = [False] * len(batch)
+        for inbound_id, positions in groups.items():
+            try:
+                group_results = await self._apply_inbound_batch(inbound_id, [batch[i] for i in positions])
+            except Exception as e:
+                logger.error(f"❌ Ошибка применения изменений inbound {inbound_id} ({len(positions)}): {e}")
+                group_results = [e] * len(positions)
+            for position, result in zip(positions, group_results):
+                results[position] = result
+        return results
+
+    async def _apply_inbound_batch(self, inbound_id: int, batch: List[ClientMutation]) -> List[bool]:
+        """
+        Одно изменение - точечный эндпоинт, только добавления - один addClient,
+        иначе одна перезапись inbound со всеми изменениями
+        """
+        if len(batch) == 1:
+            return [await self._apply_single(inbound_id, batch[0])]
+        if all(mutation.action == 'add' for mutation in batch):
+            added = await self._add_clients(inbound_id, batch)
+            return [added] * len(batch)
+        logger.info(f"📦 Объединяю {len(batch)} изменений клиентов в одно обновление inbound {inbound_id}")
+        return await self._rewrite_clients(inbound_id, batch)
+
+    async def _apply_single(self, inbound_id: int, mutation: ClientMutation) -> bool:
+        """Применяет одно изменение через точечный эндпоинт клиента"""
+        if mutation.action == 'add':
+            return await self._add_clients(inbound_id, [mutation])
+
+        if mutation.action == 'update':
+            result = await self._client_api(f"/inbounds/updateClient/{mutation.client_id}", {
+                "id": inbound_id,
+                "settings": codec.dumps({"clients": [mutation.client]})
+            })
+        else:
+            result = await self._client_api(f"/inbounds/{inbound_id}/delClient/{mutation.client_id}", {})
+        if result is None:
+            return (await self._rewrite_clients(inbound_id, [mutation]))[0]
+        return bool(result.get('success'))
+
+    async def _add_clients(self, inbound_id: int, mutations: List[ClientMutation]) -> bool:
+        """Добавляет клиентов в inbound одним вызовом addClient"""
+        result = await self._client_api("/inbounds/addClient", {
+            "id": inbound_id,
+            "settings": codec.dumps({"clients": [mutation.client for mutation in mutations]})
+        })
+        if result is None:
+            return all(await self._rewrite_clients(inbound_id, mutations))
+        self._check_not_found(result, inbound_id)
+        return bool(result.get('success'))
+
+    async def _rewrite_clients(self, inbound_id: int, mutations: List[ClientMutation]) -> List[bool]:
+        """
+        Перезаписывает inbound целиком, применив к списку клиентов все изменения по порядку.
+        Используется для пачек изменений и если панель не поддерживает точечные эндпоинты.
+        Возвращает для каждого изменения, было ли оно применено
+        """
+        inbound_config = await self._get_inbound_config(inbound_id)
+        clients = inbound_config.get('clients', [])
+        results = [_apply_mutation(clients, mutation) for mutation in mutations]
+        if not any(results):
+            return results
+
+        update_data = {
+            "up": 0,
+            "down": 0,
+            "total": 0,
+            "remark": inbound_config.get('remark'),
+            "enable": True,
+            "expiryTime": 0,
+            "listen": "",
+            "port": inbound_config.get('port'),
+            "protocol": "vless",
+            "settings": codec.dumps({
+                "clients": clients,
+                "decryption": "none",
+                "fallbacks": []
+            }),
+            "streamSettings": self._blobs.raw(inbound_config['streamSettings']),
+            "sniffing": self._blobs.raw(inbound_config['sniffing'])
+        }
+
+        status, result = await self._request('POST', f'/inbounds/update/{inbound_id}', data=update_data, timeout=30)
+        # Панель отвечает 200 и на ошибки, результат - в поле success
+        if status == 200 and isinstance(result, dict) and result.get('success'):
+            return results
+        if isinstance(result, dict):
+            self._check_not_found(result, inbound_id)
+        raise Exception(f"Ошибка обновления inbound: {result}")
+
+
+def _apply_mutation(clients: List[Dict], mutation: ClientMutation) -> bool:
+    """Применяет изменение к списку клиентов на месте, возвращает False если клиент не найден"""
+    if mutation.action == 'add':
+        clients.append(mutation.client)
+        return True
+    for i, client in enumerate(clients):
+        if client.get('id') == mutation.client_id:
+            if mutation.action == 'update':
+                clients[i] = mutation.client
+            else:
+                del clients[i]
+            return True
+    return False
+
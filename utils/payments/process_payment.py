@@ -86,7 +86,6 @@ async def execute_rate(user_id: int, months: int, vpn_id: int | None, bot: Bot,
         except Exception:
             await session.set_active(user_id, 0)
     else:
-        await manager.login()
         new_vpn = await manager.create_vpn_for_user(user_id)
         if new_vpn and new_vpn['success']:
             client_id = new_vpn["client_id"]
@@ -97,7 +96,10 @@ async def execute_rate(user_id: int, months: int, vpn_id: int | None, bot: Bot,
                 client_id=client_id,
                 link=link,
                 name=vpn_name,
-                expires_at=datetime.datetime.now() + relativedelta(months=months)
+                expires_at=datetime.datetime.now() + relativedelta(months=months),
+                inbound_id=new_vpn['inbound_id'],
+                node=new_vpn['node'],
+                ws_path=new_vpn['path']
             )
             try:
                 await bot.send_message(
@@ -0,0 +1,82 @@
+import datetime
+import logging
+
+from services.vpn.manager import AsyncVPNManager
+from database.action_data_class import DataInteraction
+
+logger = logging.getLogger(__name__)
+
+
+class VpnReconciler:
+    """
+    Сверка таблицы user-vpn с клиентами панелей.
+    Сироты - клиенты, которые есть в панели, но не в базе (недоудаленные ключи),
+    призраки - строки базы без клиента в панели (оплаченные, но нерабочие ключи).
+    Чинится только то, что найдено в двух прогонах подряд: так не задеваются
+    ключи, которые создаются или удаляются прямо во время сверки.
+    Если база пуста или сирот больше max_orphans, сироты не удаляются: скорее
+    потеряна база, чем остались недоудаленные ключи
+    """
+    def __init__(self, manager: AsyncVPNManager, session: DataInteraction, max_orphans: int = 100):
+        self.manager = manager
+        self.session = session
+        self.max_orphans = max_orphans
+        self._orphans: set = set()
+        self._ghosts: set = set()
+
+    async def run(self) -> dict:
+        clients, failed = await self.manager.snapshot_clients()
+
+        # Один проход по базе: что нашлось в снимке - вычеркиваем, остаток снимка - сироты
+        orphans = dict(clients)
+        ghosts = {}
+        rows = 0
+        now = datetime.datetime.now()
+        async for vpn in self.session.iter_vpns():
+            rows += 1
+            if orphans.pop(vpn.client_id, None) is not None:
+                continue
+            if vpn.node in failed or (vpn.node not in self.manager.nodes and failed):
+                # Клиент может быть на ноде, которая сейчас не ответила
+                continue
+            if vpn.expires_at <= now:
+                # Истекшие строки удалит ночная чистка
+                continue
+            ghosts[vpn.client_id] = vpn
+
+        confirmed_orphans = [client_id for client_id in orphans if client_id in self._orphans]
+        confirmed_ghosts = [vpn for client_id, vpn in ghosts.items() if client_id in self._ghosts]
+        self._orphans = set(orphans)
+        self._ghosts = set(ghosts)
+
+        deleted = 0
+        if confirmed_orphans and (not rows or len(orphans) > self.max_orphans):
+            logger.warning(f"⚠️ Сирот {len(orphans)} при {rows} строках в базе - удаление пропущено, "
+                           f"проверьте базу и удалите клиентов вручную")
+        elif confirmed_orphans:
+            results = await self.manager.bulk_delete(confirmed_orphans)
+            deleted = sum(results.values())
+
+        restored = {}
+        if confirmed_ghosts:
+            restored = await self.manager.restore_vpns([
+                {'user_id': vpn.user_id, 'client_id': vpn.client_id, 'vpn_name': vpn.name, 'node': vpn.node}
+                for vpn in confirmed_ghosts
+            ])
+            for vpn in confirmed_ghosts:
+                placement = restored.get(vpn.client_id)
+                if placement and (placement['node'], placement['inbound_id'], placement['path']) != \
+                        (vpn.node, vpn.inbound_id, vpn.ws_path):
+                    await self.session.update_vpn_node(
+                        vpn.id, placement['node'], placement['inbound_id'], placement['path']
+                    )
+
+        stats = {
+            'orphans': len(orphans),
+            'ghosts': len(ghosts),
+            'deleted': deleted,
+            'restored': len(restored)
+        }
+        logger.info(f"🔍 Сверка базы и панелей: сирот {stats['orphans']} (удалено {deleted}), "
+                    f"призраков {stats['ghosts']} (восстановлено {len(restored)})")
+        return stats
@@ -71,6 +71,7 @@ async def check_vpns_sub(bot: Bot, user_id: int, session: DataInteraction, manag
         if job:
             job.remove()
         return
+    expired = []
     for vpn in vpns:
         if not vpn.active:
             continue
@@ -83,14 +84,51 @@ async def check_vpns_sub(bot: Bot, user_id: int, session: DataInteraction, manag
                 )
             except Exception:
                 await session.set_active(user_id, 0)
-            await manager.login()
-            status = await manager.delete_user_vpn(vpn.inbound_id)
-            if not status:
-                print('delete vpn error')
-            await session.del_user_vpn(vpn.id)
-            if not await session.get_user_vpns(user_id):
-                job = scheduler.get_job(job_id)
-                if job:
-                    job.remove()
-                return
+            expired.append(vpn)
+    if not expired:
+        return
+
+    # Все истекшие ключи удаляются из панели одной пачкой
+    results = await manager.bulk_delete([vpn.client_id for vpn in expired])
+    deleted = []
+    for vpn in expired:
+        if vpn.client_id not in results:
+            # Нода не ответила - попробуем при следующей проверке
+            print('delete vpn error')
+            continue
+        deleted.append(vpn)
+    if deleted:
+        await session.del_user_vpns([vpn.id for vpn in deleted])
+        # Кэш подписок сбрасывается после удаления строк, иначе /sub успеет закэшировать их снова
+        for vpn in deleted:
+            manager.notify_changed(vpn.client_id, vpn.user_id)
+    if not await session.get_user_vpns(user_id):
+        job = scheduler.get_job(job_id)
+        if job:
+            job.remove()
+
+
+async def sweep_expired_vpns(bot: Bot, session: DataInteraction, manager: AsyncVPNManager):
+    """
+    Ночная чистка: все истекшие VPN удаляются из панелей пачкой, а не по одному
+    """
+    vpns = await session.get_expired_vpns()
+    if not vpns:
+        return
+    results = await manager.bulk_delete([vpn.client_id for vpn in vpns])
+
+    # Строки, чьи ноды не ответили, остаются до следующего прогона
+    deleted = [vpn for vpn in vpns if vpn.client_id in results]
+    if deleted:
+        await session.del_user_vpns([vpn.id for vpn in deleted])
+        for vpn in deleted:
+            manager.notify_changed(vpn.client_id, vpn.user_id)
+    for vpn in deleted:
+        try:
+            await bot.send_message(
+                chat_id=vpn.user_id,
+                text=f'😔К сожалению срок вашей подписки на VPN <em>`{vpn.name}`</em> подошел к концу'
+            )
+        except Exception:
+            await session.set_active(vpn.user_id, 0)
 